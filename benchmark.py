@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the SCION to Kathara topology converter.
+
+toml: compares the available TOML codecs on the br/cs/sd configuration
+files of input_scion/gen, scaled up to a given number of ASes by
+repeating them.
+
+convert: synthesises gen/-shaped topologies of increasing size and times
+the stages of the converter as well as the whole conversion, reporting
+wall time, peak RSS and throughput.
+
+generate: writes a synthetic gen/-shaped topology, e.g. to try out a
+conversion by hand.
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import queue
+import random
+import resource
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from convert_scion_topology import (
+    DEFAULT_ADDRESS_POOL,
+    DEFAULT_INTERNAL_POOL,
+    ISDAS,
+    AddressAllocator,
+    PortAllocator,
+    TopologyModel,
+    available_toml_codecs,
+    convert,
+    generate_kathara_configs,
+    preallocate_ports,
+    update_topology_json,
+)
+
+
+def load_toml_samples(source_base):
+    """
+    Read the text of every br/cs/sd TOML file of a generated topology.
+
+    Returns:
+        List of (file_name, text) tuples
+    """
+    samples = []
+    for as_dir in sorted(source_base.glob("AS*")):
+        for pattern in ("br*.toml", "cs*.toml", "sd.toml"):
+            for toml_file in sorted(as_dir.glob(pattern)):
+                samples.append((toml_file.name, toml_file.read_text()))
+    return samples
+
+
+def bench_toml(source_base, as_counts, repeat=3):
+    """
+    Time parsing and serialising the TOML files of as_counts ASes with
+    every available codec and print the best of repeat runs.
+
+    Args:
+        source_base: Generated topology to take the TOML files from
+        as_counts: Numbers of ASes to scale the sample files up to
+        repeat: Number of runs per measurement
+    """
+    samples = load_toml_samples(source_base)
+    if not samples:
+        print(f"Error: No TOML files found in {source_base}!")
+        return
+    files_per_as = len(samples) / len(list(source_base.glob("AS*")))
+    codecs = available_toml_codecs()
+
+    print(f"{'codec':<18} {'ASes':>7} {'files':>8} {'load (s)':>10} {'dump (s)':>10} {'files/s':>10}")
+    for as_count in as_counts:
+        file_count = int(as_count * files_per_as)
+        texts = [samples[i % len(samples)][1] for i in range(file_count)]
+
+        for codec in codecs.values():
+            load_time = dump_time = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                configs = [codec.loads(text) for text in texts]
+                load_time = min(load_time, time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for config in configs:
+                    codec.dumps(config)
+                dump_time = min(dump_time, time.perf_counter() - start)
+
+            rate = file_count / (load_time + dump_time)
+            print(f"{codec.name:<18} {as_count:>7} {file_count:>8} {load_time:>10.3f} {dump_time:>10.3f} {rate:>10.0f}")
+
+
+def synthetic_isd_as(index, isd_count):
+    """
+    ISD-AS of the index-th synthetic AS.
+
+    AS numbers are unique across ISDs, as in real topologies, and count up
+    in hex from ff00:0:1000 (ff00:0:1000 ... ff00:0:ffff, ff00:1:0, ...).
+    """
+    isd = 1 + index % isd_count
+    asn = 0x1000 + index
+    return f"{isd}-ff00:{asn >> 16:x}:{asn & 0xffff:x}"
+
+
+def _file_name(isd_as):
+    # 1-ff00:0:1000 -> ff00_0_1000, as used in gen/ directory and file names
+    return isd_as.split('-', 1)[1].replace(':', '_')
+
+
+def _stub(rng, size):
+    return base64.b64encode(rng.randbytes(size)).decode() + "\n"
+
+
+def generate_topology(dest, as_count, seed=0):
+    """
+    Write a synthetic topology in the layout of a SCION gen/ directory.
+
+    Every AS gets a topology.json with one border router per interface,
+    br/cs/sd TOML files and stub certs/, crypto/ and keys/ directories.
+    ifids.yml and as_list.yml describe the links and the core ASes.
+    About one AS in 50 is core; the core ASes form a ring, every other AS
+    has one or two parents and occasionally a parallel link to a parent.
+
+    Args:
+        dest: Directory to create the topology in
+        as_count: Number of ASes
+        seed: Seed of the random topology
+    """
+    rng = random.Random(seed)
+    dest.mkdir(parents=True, exist_ok=True)
+    isd_count = 1 + as_count // 2500
+    isd_ases = [synthetic_isd_as(i, isd_count) for i in range(as_count)]
+    if len({ISDAS.parse(isd_as).node_name for isd_as in isd_ases}) != as_count:
+        raise ValueError(f"Synthetic ISD-ASes of {as_count} ASes have colliding node names")
+    core_count = max(1, as_count // 50)
+    cores = isd_ases[:core_count]
+
+    # Links as (isd_as_a, isd_as_b, link_to as seen from a)
+    links = []
+    if core_count > 1:
+        for i in range(core_count):
+            links.append((cores[i], cores[(i + 1) % core_count], 'core'))
+            if core_count == 2:
+                break
+    for i in range(core_count, as_count):
+        candidates = range(i)
+        parents = rng.sample(candidates, min(len(candidates), 1 + (rng.random() < 0.2)))
+        for parent in parents:
+            links.append((isd_ases[parent], isd_ases[i], 'child'))
+            if rng.random() < 0.05:
+                links.append((isd_ases[parent], isd_ases[i], 'child'))
+
+    # Interfaces as isd_as -> list of (ifid, remote isd_as, link_to, remote ifid)
+    interfaces = {isd_as: [] for isd_as in isd_ases}
+    opposite = {'core': 'core', 'child': 'parent'}
+    for a, b, link_to in links:
+        ifid_a = len(interfaces[a]) + 1
+        ifid_b = len(interfaces[b]) + 1
+        interfaces[a].append((ifid_a, b, link_to, ifid_b))
+        interfaces[b].append((ifid_b, a, opposite[link_to], ifid_a))
+
+    trcs = {isd: _stub(rng, 1024) for isd in range(1, isd_count + 1)}
+    ifids_yml = []
+    for isd_as in isd_ases:
+        isd = isd_as.split('-')[0]
+        name = _file_name(isd_as)
+        as_dir = dest / f"AS{name}"
+        for sub_dir in ("certs", "crypto/as", "keys"):
+            (as_dir / sub_dir).mkdir(parents=True, exist_ok=True)
+
+        for trc_isd, trc in trcs.items():
+            (as_dir / "certs" / f"ISD{trc_isd}-B1-S1.trc").write_text(trc)
+        (as_dir / "crypto" / "as" / f"ISD{isd}-AS{name}.pem").write_text(_stub(rng, 1100))
+        (as_dir / "crypto" / "as" / "cp-as.key").write_text(_stub(rng, 170))
+        (as_dir / "keys" / "master0.key").write_text(_stub(rng, 16))
+        (as_dir / "keys" / "master1.key").write_text(_stub(rng, 16))
+
+        border_routers = {}
+        ifids_yml.append(f"{isd_as}:")
+        for ifid, remote, link_to, remote_ifid in interfaces[isd_as]:
+            br_name = f"br{isd}-{name}-{ifid}"
+            remote_br = f"br{remote.split('-')[0]}-{_file_name(remote)}-{remote_ifid}"
+            border_routers[br_name] = {
+                "internal_addr": f"127.0.0.1:{31000 + 2 * ifid}",
+                "interfaces": {
+                    str(ifid): {
+                        "underlay": {"local": "127.0.0.2:50000", "remote": "127.0.0.3:50000"},
+                        "isd_as": remote,
+                        "link_to": link_to,
+                        "mtu": 1472,
+                    }
+                },
+            }
+            ifids_yml.append(f"  {br_name} {ifid}: {remote_br} {remote_ifid}")
+            (as_dir / f"{br_name}.toml").write_text(
+                f'[general]\nid = "{br_name}"\nconfig_dir = "gen/AS{name}"\n\n'
+                f'[metrics]\nprometheus = "127.0.0.1:30442"\n\n[features]\n\n'
+                f'[api]\naddr = "127.0.0.1:31142"\n\n[log.console]\nlevel = "debug"\n')
+
+        cs_name = f"cs{isd}-{name}-1"
+        topology = {
+            "attributes": ["core"] if isd_as in cores else [],
+            "isd_as": isd_as,
+            "mtu": 1472,
+            "test_dispatcher": True,
+            "dispatched_ports": "31000-32767",
+            "control_service": {cs_name: {"addr": "127.0.0.1:31000"}},
+            "discovery_service": {cs_name: {"addr": "127.0.0.1:31000"}},
+            "border_routers": border_routers,
+        }
+        (as_dir / "topology.json").write_text(json.dumps(topology, indent=2) + "\n")
+        (as_dir / f"{cs_name}.toml").write_text(
+            f'[general]\nid = "{cs_name}"\nconfig_dir = "gen/AS{name}"\n\n'
+            f'[trust_db]\nconnection = "gen-cache/{cs_name}.trust.db"\n\n'
+            f'[beacon_db]\nconnection = "gen-cache/{cs_name}.beacon.db"\n\n'
+            f'[path_db]\nconnection = "gen-cache/{cs_name}.path.db"\n\n'
+            f'[tracing]\nenabled = true\ndebug = true\nagent = "172.17.0.1:6831"\n\n'
+            f'[metrics]\nprometheus = "127.0.0.1:30452"\n\n'
+            f'[api]\naddr = "127.0.0.1:31152"\n\n[features]\n\n'
+            f'[ca]\nmode = "in-process"\n\n[log.console]\nlevel = "debug"\n')
+        (as_dir / "sd.toml").write_text(
+            f'[general]\nid = "sd{isd}-{name}"\nconfig_dir = "gen/AS{name}"\n\n'
+            f'[trust_db]\nconnection = "gen-cache/sd{isd}-{name}.trust.db"\n\n'
+            f'[path_db]\nconnection = "gen-cache/sd{isd}-{name}.path.db"\n\n'
+            f'[sd]\naddress = "127.0.0.1:30255"\n\n'
+            f'[tracing]\nenabled = true\ndebug = true\nagent = "172.17.0.1:6831"\n\n'
+            f'[metrics]\nprometheus = "127.0.0.1:30455"\n\n[features]\n\n'
+            f'[api]\naddr = "127.0.0.1:30955"\n\n[log.console]\nlevel = "debug"\n')
+
+    (dest / "ifids.yml").write_text("\n".join(ifids_yml) + "\n")
+    as_list = ["Core:"] + [f"- {isd_as}" for isd_as in cores]
+    as_list += ["Non-core:"] + [f"- {isd_as}" for isd_as in isd_ases[core_count:]]
+    (dest / "as_list.yml").write_text("\n".join(as_list) + "\n")
+
+
+def _count_files(directory):
+    return sum(1 for path in directory.rglob('*') if path.is_file())
+
+
+def _load_model(source_base):
+    model = TopologyModel.load(source_base)
+    model.assign_addresses(AddressAllocator(DEFAULT_ADDRESS_POOL),
+                           AddressAllocator(DEFAULT_INTERNAL_POOL))
+    return model
+
+
+def _stage_load_model(source_base, work_dir, jobs):
+    return len(TopologyModel.load(source_base).ases)
+
+
+def _stage_index_links(source_base, work_dir, jobs):
+    model = TopologyModel.load(source_base)
+    start = time.perf_counter()
+    model.index_links()
+    return len(model.links), start
+
+
+def _stage_get_port(source_base, work_dir, jobs):
+    model = _load_model(source_base)
+    start = time.perf_counter()
+    preallocate_ports(model, PortAllocator())
+    return len(model.links), start
+
+
+def _stage_topology_json(source_base, work_dir, jobs):
+    model = _load_model(source_base)
+    port_allocator = PortAllocator()
+    preallocate_ports(model, port_allocator)
+    start = time.perf_counter()
+    for asys in model.ases.values():
+        update_topology_json(work_dir / f"{asys.node_name}.json", model, asys, port_allocator)
+    return len(model.ases), start
+
+
+def _stage_kathara_configs(source_base, work_dir, jobs):
+    model = _load_model(source_base)
+    start = time.perf_counter()
+    generate_kathara_configs(work_dir, model, log=lambda *args: None)
+    return _count_files(work_dir), start
+
+
+def _stage_convert(source_base, work_dir, jobs):
+    convert(source_base, work_dir, jobs=jobs, force=True, quiet=True)
+    return _count_files(work_dir)
+
+
+# (label, unit of the throughput, stage function). Stage functions return
+# the number of items processed and optionally the time their timed part
+# started, if they need an untimed setup first.
+STAGES = [
+    ("TopologyModel.load", "ASes", _stage_load_model),
+    ("TopologyModel.index_links", "links", _stage_index_links),
+    ("PortAllocator.get_port", "links", _stage_get_port),
+    ("update_topology_json", "files", _stage_topology_json),
+    ("generate_kathara_configs", "files", _stage_kathara_configs),
+    ("convert (end to end)", "files", _stage_convert),
+]
+
+
+def _run_stage(stage, source_base, jobs, queue):
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            start = time.perf_counter()
+            result = stage(source_base, Path(work_dir), jobs)
+            end = time.perf_counter()
+    except Exception as e:
+        queue.put(e)
+        return
+    items, start = result if isinstance(result, tuple) else (result, start)
+    # ru_maxrss is in KiB on Linux
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    queue.put((end - start, peak_rss, items))
+
+
+def _wait_stage(process, results):
+    """
+    Wait for the result of a stage's process, or an exception if the
+    process died without one (e.g. killed for running out of memory).
+    """
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # The result may have been put just before the process exited
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            process.join()
+            return RuntimeError(f"stage process exited with code {process.exitcode}")
+
+
+def bench_convert(as_counts, jobs=1, work_dir=None, seed=0):
+    """
+    Time the converter stages on synthetic topologies of as_counts ASes.
+
+    Every stage runs in a fresh process, so that its peak RSS is not
+    hidden by earlier stages. The peak RSS includes the untimed setup of
+    a stage, e.g. loading the model.
+
+    Args:
+        as_counts: Numbers of ASes of the synthetic topologies
+        jobs: Number of parallel jobs for the end-to-end conversion
+        work_dir: Directory for the synthetic topologies (default: temporary)
+        seed: Seed of the synthetic topologies
+    """
+    context = multiprocessing.get_context("fork")
+    print(f"{'stage':<26} {'ASes':>7} {'wall (s)':>10} {'peak RSS (MiB)':>15} {'items':>8} {'items/s':>8}")
+
+    for as_count in as_counts:
+        base = Path(work_dir) if work_dir else Path(tempfile.mkdtemp(prefix="scion-bench-"))
+        source_base = base / f"gen-{as_count}"
+        if source_base.exists():
+            shutil.rmtree(source_base)
+        generate_topology(source_base, as_count, seed)
+
+        for label, unit, stage in STAGES:
+            results = context.Queue()
+            process = context.Process(target=_run_stage, args=(stage, source_base, jobs, results))
+            process.start()
+            result = _wait_stage(process, results)
+            process.join()
+            if isinstance(result, Exception):
+                print(f"{label:<26} {as_count:>7} failed: {result}")
+                continue
+            wall, peak_rss, items = result
+            print(f"{label:<26} {as_count:>7} {wall:>10.3f} {peak_rss / 1024:>15.1f} "
+                  f"{items:>8} {items / wall if wall else 0:>8.0f} {unit}")
+
+        shutil.rmtree(source_base)
+        if not work_dir:
+            shutil.rmtree(base)
+
+
+def main(argv=None):
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Benchmark the SCION to Kathara converter.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    toml_parser = subparsers.add_parser("toml", help="compare the TOML codecs")
+    toml_parser.add_argument("--source", type=Path, default=script_dir / "input_scion" / "gen",
+                             help="generated SCION topology to take the TOML files from")
+    toml_parser.add_argument("--ases", type=int, nargs="+", default=[1000, 5000],
+                             help="numbers of ASes to scale the files up to (default: 1000 5000)")
+    toml_parser.add_argument("--repeat", type=int, default=3,
+                             help="runs per measurement, the best one is reported (default: 3)")
+
+    convert_parser = subparsers.add_parser("convert", help="time the converter on synthetic topologies")
+    convert_parser.add_argument("--ases", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                                help="numbers of ASes of the synthetic topologies "
+                                     "(default: 10 100 1000 10000)")
+    convert_parser.add_argument("-j", "--jobs", type=int, default=1,
+                                help="parallel jobs for the end-to-end conversion (default: 1)")
+    convert_parser.add_argument("--work-dir", type=Path,
+                                help="directory for the synthetic topologies (default: temporary)")
+    convert_parser.add_argument("--seed", type=int, default=0,
+                                help="seed of the synthetic topologies (default: 0)")
+
+    generate_parser = subparsers.add_parser("generate", help="write a synthetic topology")
+    generate_parser.add_argument("dest", type=Path, help="directory to write the topology to")
+    generate_parser.add_argument("--ases", type=int, default=100,
+                                 help="number of ASes (default: 100)")
+    generate_parser.add_argument("--seed", type=int, default=0,
+                                 help="seed of the topology (default: 0)")
+
+    args = parser.parse_args(argv)
+    if args.benchmark == "toml":
+        bench_toml(args.source, args.ases, args.repeat)
+    elif args.benchmark == "convert":
+        bench_convert(args.ases, max(1, args.jobs), args.work_dir, args.seed)
+    elif args.benchmark == "generate":
+        generate_topology(args.dest, args.ases, args.seed)
+
+
+if __name__ == "__main__":
+    main()
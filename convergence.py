@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Convergence collector for labs generated by convert_scion_topology.py.
+
+Polls the control service and daemon APIs of every AS of the lab
+concurrently and records when each API first answers, when each AS
+first has up, core and down segments, and when every pair of ASes
+first has a path, until the lab has converged or the timeout expires.
+
+The converter copies this script into the lab's shared/ directory
+together with convergence_targets.json, the API addresses of all ASes.
+With the default shared underlay, run it on any node, which reaches
+all of them:
+    kathara exec as1_110 -- python3 /shared/convergence.py
+
+Otherwise (point-to-point links, isolated intra-AS networks), run it on
+the host with --via, which polls every AS's APIs from inside its own
+node with the fetch subcommand of this script:
+    cd KatharaLab && python3 shared/convergence.py --via kathara
+    python3 KatharaLab/shared/convergence.py --via netns
+
+Paths are derived from the segments the control services hold: an AS
+has a path to another if one of its up segments (or the AS itself, if
+core) reaches a core AS that is connected by a core segment (or equal)
+to a core AS holding a down segment to the other AS (or the other AS
+itself, if core).
+"""
+
+import argparse
+import csv
+import json
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+TARGETS_NAME = "convergence_targets.json"
+
+# Where the APIs are polled from:
+#   direct: from this host or node
+#   kathara: from inside each AS's node, with kathara exec (run in the lab directory)
+#   netns: from inside each AS's network namespace, with ip netns exec
+VIA_MODES = ("direct", "kathara", "netns")
+
+
+def fetch_command(via, node, address, path, timeout):
+    """
+    Command line running the fetch subcommand of this script in a node.
+    """
+    if via == "kathara":
+        prefix, script = ["kathara", "exec", node, "--"], "/shared/convergence.py"
+    else:
+        prefix, script = ["ip", "netns", "exec", node], str(Path(__file__).resolve())
+    return prefix + ["python3", script, "fetch", address, path, str(timeout)]
+
+
+def get(address, path, timeout, via="direct", node=None):
+    """
+    GET an API path, returning the decoded JSON body (None if it is not
+    JSON), or raising OSError if the API does not answer.
+
+    Args:
+        address: Address and port of the API
+        path: Path to GET
+        timeout: Seconds to wait for the answer
+        via: One of VIA_MODES
+        node: Node to poll from, unless via is "direct"
+    """
+    if via != "direct":
+        command = fetch_command(via, node, address, path, timeout)
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=timeout + 30)
+        except subprocess.TimeoutExpired as e:
+            raise OSError(f"{' '.join(command)} timed out") from e
+        lines = result.stdout.strip().splitlines()
+        try:
+            answer = json.loads(lines[-1]) if lines else {}
+        except ValueError:
+            answer = {}
+        if not isinstance(answer, dict) or not answer.get("answered"):
+            raise OSError(f"{address}{path} does not answer in {node}")
+        return answer.get("body")
+
+    try:
+        with urllib.request.urlopen(f"http://{address}{path}", timeout=timeout) as response:
+            body = response.read()
+    except urllib.error.HTTPError:
+        # The API answers, just not this path
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def poll(target, api_prefix, timeout, via="direct"):
+    """
+    Poll the APIs of one AS, from inside its node unless via is "direct".
+
+    Returns:
+        (control service answers, daemon answers, list of (start, end) ISD-AS
+        pairs of the control service's segments)
+    """
+    try:
+        segments = get(target["cs"], f"{api_prefix}/segments", timeout, via, target["node"])
+        cs_ready = True
+    except OSError:
+        segments, cs_ready = None, False
+    try:
+        get(target["sd"], f"{api_prefix}/info", timeout, via, target["node"])
+        sd_ready = True
+    except OSError:
+        sd_ready = False
+    ends = [(segment["start_isd_as"], segment["end_isd_as"]) for segment in segments or []
+            if isinstance(segment, dict) and "start_isd_as" in segment and "end_isd_as" in segment]
+    return cs_ready, sd_ready, ends
+
+
+def reachable_pairs(ases, segments):
+    """
+    The (source, destination) pairs of ASes with a path, see the module
+    docstring.
+
+    Args:
+        ases: Dictionary mapping every ISD-AS to whether it is core
+        segments: Dictionary mapping ISD-ASes to the (start, end) pairs of
+            their control service's segments
+    """
+    ups = {isd_as: set() for isd_as in ases}
+    downs = {isd_as: set() for isd_as in ases}
+    core_links = {isd_as: {isd_as} for isd_as, core in ases.items() if core}
+    for holder, ends in segments.items():
+        for start, end in ends:
+            if start not in ases or end not in ases:
+                continue
+            if ases[start] and ases[end]:
+                core_links[start].add(end)
+                core_links[end].add(start)
+            elif ases[start] and end == holder:
+                ups[end].add(start)
+            elif ases[start] and holder == start:
+                downs[end].add(start)
+
+    pairs = set()
+    for src, src_core in ases.items():
+        first = {src} if src_core else ups[src]
+        cores = set()
+        for core in first:
+            cores |= core_links.get(core, set())
+        for dst, dst_core in ases.items():
+            if dst != src and ({dst} if dst_core else downs[dst]) & cores:
+                pairs.add((src, dst))
+    return pairs
+
+
+def collect(targets, interval, timeout, api_prefix, workers, via="direct", log=print):
+    """
+    Poll all targets until every pair of ASes has a path or timeout
+    seconds have passed.
+
+    Returns:
+        (seconds to convergence or None, list of (seconds, event, ISD-AS,
+        peer ISD-AS or "") events in time order)
+    """
+    ases = {target["isd_as"]: target["core"] for target in targets}
+    first = {}
+    events = []
+    start = time.monotonic()
+
+    def record(seconds, event, isd_as, peer=""):
+        if (event, isd_as, peer) not in first:
+            first[event, isd_as, peer] = seconds
+            events.append((round(seconds, 3), event, isd_as, peer))
+
+    all_pairs = len(ases) * (len(ases) - 1)
+    paths = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            results = list(executor.map(lambda target: poll(target, api_prefix, interval, via),
+                                        targets))
+            seconds = time.monotonic() - start
+            segments = {}
+            for target, (cs_ready, sd_ready, ends) in zip(targets, results):
+                isd_as = target["isd_as"]
+                segments[isd_as] = ends
+                if cs_ready:
+                    record(seconds, "cs", isd_as)
+                if sd_ready:
+                    record(seconds, "sd", isd_as)
+                for seg_start, seg_end in ends:
+                    if seg_start not in ases or seg_end not in ases:
+                        continue
+                    if ases[seg_start] and ases[seg_end]:
+                        record(seconds, "core", isd_as)
+                    elif seg_end == isd_as:
+                        record(seconds, "up", isd_as)
+                    else:
+                        record(seconds, "down", isd_as)
+
+            for src, dst in sorted(reachable_pairs(ases, segments)):
+                record(seconds, "path", src, dst)
+            reached = sum(1 for event, _, _ in first if event == "path")
+            if reached != paths:
+                paths = reached
+                log(f"{seconds:8.1f}s  {paths}/{all_pairs} AS pairs with a path")
+            if paths == all_pairs:
+                return seconds, events
+            if seconds >= timeout:
+                return None, events
+            time.sleep(max(0.0, interval - (time.monotonic() - start - seconds)))
+
+
+def write_timeline(output, converged, events, started):
+    """
+    Write the timeline as CSV (if output ends with .csv) or JSON.
+    """
+    output = Path(output)
+    if output.suffix == ".csv":
+        with open(output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("seconds", "event", "isd_as", "peer"))
+            writer.writerows(events)
+            writer.writerow((converged if converged is None else round(converged, 3),
+                             "converged", "", ""))
+        return
+    with open(output, "w") as f:
+        json.dump({"started": started, "converged": converged if converged is None
+                   else round(converged, 3),
+                   "events": events}, f, separators=(",", ":"))
+        f.write("\n")
+
+
+def fetch(address, path, timeout):
+    """
+    The fetch subcommand: GET an API path from this node and print
+    whether it answered, with its body, as one line of JSON.
+    """
+    try:
+        answer = {"answered": True, "body": get(address, path, timeout)}
+    except OSError:
+        answer = {"answered": False}
+    print(json.dumps(answer, separators=(",", ":")))
+    return 0
+
+
+def main(argv=None):
+    script_dir = Path(__file__).parent
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["fetch"] and len(argv) == 4:
+        return fetch(argv[1], argv[2], float(argv[3]))
+    parser = argparse.ArgumentParser(description="Measure the convergence of a SCION lab.")
+    parser.add_argument("--targets", type=Path, default=script_dir / TARGETS_NAME,
+                        help=f"API addresses of the ASes (default: {TARGETS_NAME} next to this script)")
+    parser.add_argument("-o", "--output", type=Path, default=script_dir / "convergence.json",
+                        help="timeline to write, CSV if it ends with .csv (default: convergence.json "
+                             "next to this script)")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="seconds between polls (default: 1)")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="seconds to wait for convergence (default: 600)")
+    parser.add_argument("--api-prefix", default="/api/v1",
+                        help="path prefix of the control service and daemon APIs (default: /api/v1)")
+    parser.add_argument("-j", "--workers", type=int, default=32,
+                        help="number of APIs polled concurrently (default: 32)")
+    parser.add_argument("--via", choices=VIA_MODES, default="direct",
+                        help="poll the APIs directly, or from inside each AS's node with kathara exec "
+                             "or ip netns exec (default: direct)")
+    args = parser.parse_args(argv)
+
+    with open(args.targets) as f:
+        targets = json.load(f)
+    started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    converged, events = collect(targets, args.interval, args.timeout, args.api_prefix,
+                                max(1, args.workers), args.via)
+    write_timeline(args.output, converged, events, started)
+    if converged is None:
+        print(f"Not converged after {args.timeout:.0f}s, timeline written to {args.output}")
+        return 1
+    print(f"Converged after {converged:.1f}s, timeline written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
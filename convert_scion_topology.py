@@ -2,17 +2,19 @@
 """
 Script to convert SCION topology from generated format to Kathara lab format.
 
-The script automatically detects AS directories and maps them to node directories:
-- ASff00_0_110 => AS_110
-- ASff00_0_111 => AS_111
+The script automatically detects AS directories and maps them to node directories
+named after their ISD-AS:
+- 1-ff00:0:110 (ASff00_0_110) => as1_110
+- 2-ff00:0:210 (ASff00_0_210) => as2_210
 - etc.
 
 For each AS:
 - Copy certs/, crypto/, keys/ directories
 - Consolidate all border routers into a single br.toml
 - Rename cs*.toml to cs.toml
-- Copy sd.toml and topology.json
-- Update configuration files with proper IP addresses and unique port assignments
+- Convert sd.toml and topology.json
+- Update configuration files with proper IP addresses and unique port assignments,
+  reading each source file once and writing its converted version atomically
 - Handle multiple links between border routers
 
 Additionally generates Kathara lab configuration:
@@ -20,46 +22,290 @@ Additionally generates Kathara lab configuration:
 - .startup scripts for each node with IP configuration and SCION service startup
 """
 
+import argparse
+import functools
+import hashlib
+import ipaddress
 import os
 import shutil
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import re
 import json
-import toml
+import yaml
+
+# The C implementation of the YAML parser is much faster on the ifids.yml
+# of large topologies, if PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# TOML backends: the stdlib tomllib (or tomli before Python 3.11) for
+# reading and tomli_w for writing are much faster than the pure-Python
+# toml package, which is only needed when they are not installed
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+try:
+    import tomli_w
+except ImportError:
+    tomli_w = None
+try:
+    import toml
+except ImportError:
+    toml = None
+
+# Bump whenever a change to the converter alters its output, so that
+# incremental runs reconvert every AS instead of trusting the manifest
+CONVERTER_VERSION = "4"
+
+MANIFEST_NAME = ".convert-manifest.json"
+
+DEFAULT_BASE_PORT = 50000
+# Address pools of the inter-AS network (eth0) and the internal network (eth1)
+DEFAULT_ADDRESS_POOL = "10.0.0.0/16"
+DEFAULT_INTERNAL_POOL = "192.168.0.0/16"
+
+# How the inter-AS links are emulated:
+#   shared: all nodes share one collision domain (net_0)
+#   p2p: one collision domain and /31 network per link
+UNDERLAY_MODES = ("shared", "p2p")
+DEFAULT_LINK_POOL = "172.16.0.0/12"
+
+# How the intra-AS (BR <-> CS <-> SD) networks are emulated:
+#   shared: all nodes share one internal collision domain (net_1)
+#   isolated: one internal collision domain and subnet per AS
+INTRA_AS_MODES = ("shared", "isolated")
+DEFAULT_INTRA_AS_PREFIXLEN = 28
+
+# How the border routers of an AS are deployed:
+#   consolidated: one router ('br') with all interfaces, in the AS node
+#   container: every router in its own Kathara node
+#   process: every router as its own scion-router process in the AS node
+BR_MODES = ("consolidated", "container", "process")
+BR_API_PORT = 31442
+CS_API_PORT = 31152
+SD_API_PORT = 30955
+
+# Seconds a node's .startup script waits for all its services to answer
+READINESS_TIMEOUT = 120
+
+DEFAULT_IMAGE = "kathara/scion-local"
+
+# Output backends:
+#   kathara: one Kathara lab (lab.conf and .startup scripts), Docker containers
+#   netns: a launcher script running every node in a Linux network namespace
+BACKENDS = ("kathara", "netns")
+
+# Sharded labs: allowed shard load above the average (see
+# TopologyModel.partition) and VXLAN IDs of the cross-shard collision domains
+SHARD_IMBALANCE = 0.05
+VXLAN_BASE_VNI = 4096
+VXLAN_PORT = 4789
+
+# Concurrent lab instances (--instance-id): number of instances the address
+# pools are split between (see instance_network) and VXLAN IDs per instance
+MAX_INSTANCES = 16
+INSTANCE_VNI_STRIDE = 1 << 16
+
+# How certs/, crypto/ and keys/ are materialised in the node directories
+LINK_MODES = ("copy", "hardlink", "reflink", "symlink")
+
+# Files the services write into a node's /etc/scion at run time (the
+# netns backend bind-mounts the node directory), which pruning keeps
+RUNTIME_FILE_PATTERN = re.compile(r".+\.db(-wal|-shm|-journal)?")
+
+# ioctl request number of FICLONE (see linux/fs.h)
+FICLONE = 0x40049409
+
+
+def write_atomic(file_path, text):
+    """
+    Write a text file atomically: readers see either the old or the new
+    content, never a partially written file.
+
+    Args:
+        file_path: Path of the file to write
+        text: Content of the file, either a string or an iterable of strings
+            that is streamed to disk
+    """
+    file_path = Path(file_path)
+    tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w') as f:
+            if isinstance(text, str):
+                f.write(text)
+            else:
+                f.writelines(text)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
+
+class TomlCodec:
+    """
+    A TOML reader/writer pair used for all br/cs/sd configuration files.
+    """
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def load(self, file_path):
+        with open(file_path, 'rb') as f:
+            return self.loads(f.read().decode())
+
+    def dump(self, config, file_path):
+        write_atomic(file_path, self.dumps(config))
+
+
+@functools.lru_cache(maxsize=None)
+def available_toml_codecs():
+    """
+    List the TOML codecs that can be used with the installed packages.
+
+    Returns:
+        Dictionary mapping codec names to TomlCodec, fastest first
+    """
+    codecs = {}
+    if tomllib is not None and tomli_w is not None:
+        codecs['tomllib+tomli_w'] = TomlCodec('tomllib+tomli_w', tomllib.loads, tomli_w.dumps)
+    if tomllib is not None and toml is not None:
+        codecs['tomllib+toml'] = TomlCodec('tomllib+toml', tomllib.loads, toml.dumps)
+    if toml is not None:
+        codecs['toml'] = TomlCodec('toml', toml.loads, toml.dumps)
+    return codecs
 
 
-def extract_as_number(as_name):
-    match = re.search(r'_(\d+)$', as_name)
-    if match:
-        return int(match.group(1))
-    return None
+def get_toml_codec(name=None):
+    """
+    Get a TOML codec by name, or the fastest available one.
+    """
+    codecs = available_toml_codecs()
+    if not codecs:
+        raise ImportError("No TOML backend found, install tomli-w (or toml)")
+    if name is None:
+        return next(iter(codecs.values()))
+    return codecs[name]
 
 
-def build_as_to_node_mapping(source_base):
-    as_to_node = {}
+# Largest AS number in decimal notation (BGP AS numbers), larger ones are
+# written as three colon-separated 16-bit hex groups
+MAX_BGP_AS = (1 << 32) - 1
+# The AS numbers ff00:0:0 - ff00:0:ffff, used by generated test topologies
+TEST_AS_PREFIX = 0xff00_0000_0000
+
+
+def parse_as(text, separator=':'):
+    """
+    Parse an AS number, in decimal (64512) or as three 16-bit hex groups
+    (ff00:0:110, or ff00_0_110 with separator '_' as in file names).
 
-    # Find all AS directories
-    as_dirs = [d for d in source_base.iterdir()
-               if d.is_dir() and d.name.startswith('AS')]
+    Raises:
+        ValueError: if text is not a valid AS number
+    """
+    groups = text.split(separator)
+    if len(groups) == 1 and re.fullmatch(r'\d{1,10}', text) and int(text) <= MAX_BGP_AS:
+        return int(text)
+    if len(groups) == 3 and all(re.fullmatch(r'[0-9a-fA-F]{1,4}', group) for group in groups):
+        high, middle, low = (int(group, 16) for group in groups)
+        return (high << 32) | (middle << 16) | low
+    raise ValueError(f"Invalid AS number {text!r}")
 
-    # Sort by AS number for consistent ordering
-    as_dirs_with_numbers = []
-    for as_dir in as_dirs:
-        as_num = extract_as_number(as_dir.name)
-        if as_num is not None:
-            as_dirs_with_numbers.append((as_num, as_dir.name))
 
-    as_dirs_with_numbers.sort()
+class ISDAS(namedtuple('ISDAS', ('isd', 'asn'))):
+    """
+    ISD-AS identifier: ISD number and 48-bit AS number. Hashes and compares
+    as a plain tuple, so it is cheap to use as a dictionary key, and sorts
+    by ISD, then AS number.
+    """
+    __slots__ = ()
 
-    # Create mapping: AS number with AS_ prefix (e.g., ASff00_0_110 -> AS_110)
-    for as_num, as_name in as_dirs_with_numbers:
-        as_to_node[as_name] = f"as_{as_num}"
+    @classmethod
+    def parse(cls, text):
+        """
+        Parse an ISD-AS such as 1-ff00:0:110 or 1-64512.
 
-    return as_to_node
+        Raises:
+            ValueError: if text is not a valid ISD-AS
+        """
+        isd, sep, asn = str(text).partition('-')
+        if not sep or not isd.isdigit() or int(isd) > 0xffff:
+            raise ValueError(f"Invalid ISD-AS {text!r}")
+        return cls(int(isd), parse_as(asn))
 
+    def as_str(self, separator=':'):
+        """
+        The AS number in SCION notation (ff00:0:110, or decimal for BGP AS numbers).
+        """
+        if self.asn <= MAX_BGP_AS:
+            return str(self.asn)
+        return separator.join(f"{(self.asn >> shift) & 0xffff:x}" for shift in (32, 16, 0))
 
-def update_br_toml(file_path, node_number):
-    config = toml.load(file_path)
+    def __str__(self):
+        return f"{self.isd}-{self.as_str()}"
+
+    @property
+    def node_name(self):
+        """
+        Compact node name, unique per ISD-AS and usable as a Kathara machine
+        name: as1_110 for 1-ff00:0:110, as1_n64512 for the BGP AS 1-64512,
+        as1_1_2_3 for 1-1:2:3.
+        """
+        if self.asn & ~0xffff == TEST_AS_PREFIX:
+            return f"as{self.isd}_{self.asn & 0xffff:x}"
+        if self.asn <= MAX_BGP_AS:
+            return f"as{self.isd}_n{self.asn}"
+        return f"as{self.isd}_{self.as_str('_')}"
+
+    @property
+    def short_number(self):
+        """
+        The last group of the AS number if it reads as a decimal number
+        (110 for ff00:0:110), as test topologies choose their AS numbers
+        that way; None otherwise.
+        """
+        text = f"{self.asn & 0xffff:x}"
+        return int(text) if text.isdigit() else None
+
+
+def find_as_dirs(source_base):
+    """
+    Find the AS directories (e.g., ASff00_0_110) of a generated topology.
+
+    Returns:
+        List of AS directories, sorted by AS number
+    """
+    as_dirs = []
+    for as_dir in source_base.iterdir():
+        if as_dir.is_dir() and as_dir.name.startswith('AS'):
+            try:
+                as_dirs.append((parse_as(as_dir.name[2:], '_'), as_dir))
+            except ValueError:
+                continue
+    as_dirs.sort()
+    return [as_dir for _, as_dir in as_dirs]
+
+
+def update_br_toml(src_path, dst_path, ip, br_id='br', api_port=BR_API_PORT):
+    """
+    Read a border router br*.toml, update it and write it to dst_path.
+
+    Args:
+        src_path: br*.toml to read
+        dst_path: Path to write the updated configuration to
+        ip: Address to bind the API on
+        br_id: Border router ID, as in topology.json
+        api_port: Port to bind the API on
+    """
+    codec = get_toml_codec()
+    config = codec.load(src_path)
 
     # Remove metrics section
     if 'metrics' in config:
@@ -68,21 +314,23 @@ def update_br_toml(file_path, node_number):
     # Update config_dir
     if 'general' in config:
         config['general']['config_dir'] = '/etc/scion/'
-        # Set the border router ID to 'br' to match consolidated topology.json
-        config['general']['id'] = 'br'
+        # Set the border router ID to match topology.json ('br' when consolidated)
+        config['general']['id'] = br_id
 
     # Update api address
     if 'api' in config:
-        ip = node_to_ip(node_number)
-        config['api']['addr'] = f'10.0.0.{ip}:31442'
+        config['api']['addr'] = f'{ip}:{api_port}'
 
-    # Write back to file
-    with open(file_path, 'w') as f:
-        toml.dump(config, f)
+    # Write to the destination
+    codec.dump(config, dst_path)
 
 
-def update_cs_toml(file_path, node_number):
-    config = toml.load(file_path)
+def update_cs_toml(src_path, dst_path, ip):
+    """
+    Read a control service cs*.toml, update it and write it to dst_path.
+    """
+    codec = get_toml_codec()
+    config = codec.load(src_path)
 
     # Remove metrics section
     if 'metrics' in config:
@@ -106,24 +354,23 @@ def update_cs_toml(file_path, node_number):
 
     # Update api address
     if 'api' in config:
-        ip = node_to_ip(node_number)
-        config['api']['addr'] = f'10.0.0.{ip}:31152'
+        config['api']['addr'] = f'{ip}:{CS_API_PORT}'
 
-    # Write back to file
-    with open(file_path, 'w') as f:
-        toml.dump(config, f)
+    # Write to the destination
+    codec.dump(config, dst_path)
 
 
-def update_sd_toml(file_path, node_number):
+def update_sd_toml(src_path, dst_path, ip):
     """
-    Update sd.toml file:
+    Read sd.toml, update it and write it to dst_path:
     1. Remove metrics section
     2. Remove tracing section
-    3. Change all addresses to 10.0.0.NODE_NUMBER
+    3. Change all addresses to the node address ip
     4. Change folder for databases to /etc/scion/
     5. Change config_dir to /etc/scion/
     """
-    config = toml.load(file_path)
+    codec = get_toml_codec()
+    config = codec.load(src_path)
 
     # Remove metrics section
     if 'metrics' in config:
@@ -145,64 +392,206 @@ def update_sd_toml(file_path, node_number):
 
     # Update sd address
     if 'sd' in config:
-        ip = node_to_ip(node_number)
-        config['sd']['address'] = f'10.0.0.{ip}:30255'
+        config['sd']['address'] = f'{ip}:30255'
 
     # Update api address
     if 'api' in config:
-        ip = node_to_ip(node_number)
-        config['api']['addr'] = f'10.0.0.{ip}:30955'
+        config['api']['addr'] = f'{ip}:{SD_API_PORT}'
 
-    # Write back to file
-    with open(file_path, 'w') as f:
-        toml.dump(config, f)
+    # Write to the destination
+    codec.dump(config, dst_path)
 
 
-def extract_node_from_isd_as(isd_as):
+def instance_network(cidr, instance):
     """
-    Extract AS number from ISD-AS format.
-    Examples:
-      1-ff00:0:110 -> 110
-      1-ff00:0:111 -> 111
-    """
-    # Extract the last part after the last colon
-    match = re.search(r':(\d+)$', isd_as)
-    if match:
-        as_number = int(match.group(1))
-        return as_number
-    return None
-
+    The address pool of a lab instance: the instance-th of the
+    MAX_INSTANCES equal subnets of the given pool, e.g. 10.0.32.0/20 for
+    10.0.0.0/16 and instance 2, so the instances never leave the pool.
 
-def node_to_ip(node_number):
+    Raises:
+        ValueError: if the instance is out of range or the pool is too
+            small to be split
     """
-    Convert AS number to IP address.
-    AS 110 -> 10.0.0.110, AS 111 -> 10.0.0.111, etc.
+    network = ipaddress.IPv4Network(cidr)
+    if not 0 <= instance < MAX_INSTANCES:
+        raise ValueError(f"Instance {instance} is out of range 0-{MAX_INSTANCES - 1}")
+    prefixlen = network.prefixlen + (MAX_INSTANCES - 1).bit_length()
+    if prefixlen > 30:
+        raise ValueError(f"Address pool {network} is too small to split between "
+                         f"{MAX_INSTANCES} instances")
+    size = 1 << (32 - prefixlen)
+    return ipaddress.IPv4Network((int(network.network_address) + instance * size, prefixlen))
+
+
+class AddressAllocator:
     """
-    return node_number
+    Hands out stable IPv4 addresses to nodes from a CIDR pool, optionally
+    with a separate pool per ISD. Used addresses are tracked in a bitmap
+    per pool, so even a /8 costs only 2 MiB.
+    """
+    def __init__(self, network, isd_networks=None):
+        self.network = ipaddress.IPv4Network(network)
+        # Key: ISD number, Value: pool of the ASes of that ISD
+        self.isd_networks = {int(isd): ipaddress.IPv4Network(isd_network)
+                             for isd, isd_network in (isd_networks or {}).items()}
+        # Key: pool, Value: [bitmap of used host offsets, lowest possibly free offset]
+        self._pools = {}
+        # Key: node name, Value: (pool, host offset)
+        self.assignments = {}
+
+        pools = [self.network] + list(self.isd_networks.values())
+        for i, pool in enumerate(pools):
+            for other in pools[i + 1:]:
+                if pool.overlaps(other):
+                    raise ValueError(f"Address pools {pool} and {other} overlap")
+
+    def pool(self, isd=None):
+        """
+        The pool addresses of an ISD's ASes are taken from.
+        """
+        return self.isd_networks.get(isd, self.network)
+
+    def _usable(self, pool, offset):
+        # Skip the network and broadcast addresses, except in /31 and /32
+        if pool.num_addresses <= 2:
+            return 0 <= offset < pool.num_addresses
+        return 0 < offset < pool.num_addresses - 1
+
+    def allocate(self, node, isd=None, preferred=None):
+        """
+        Allocate an address for a node, or return the one it already has.
+
+        Args:
+            node: Name of the node
+            isd: ISD of the node, selecting its pool
+            preferred: Preferred host offset within the pool, used if it is
+                free (e.g. the AS number, so AS 110 gets 10.0.0.110)
+
+        Returns:
+            IPv4Address of the node
+        """
+        if node in self.assignments:
+            pool, offset = self.assignments[node]
+            return pool[offset]
+
+        pool = self.pool(isd)
+        if pool not in self._pools:
+            self._pools[pool] = [bytearray((pool.num_addresses + 7) // 8), 0]
+        bitmap, next_free = self._pools[pool]
+
+        offset = preferred
+        if offset is None or not self._usable(pool, offset) or bitmap[offset >> 3] & (1 << (offset & 7)):
+            # First free offset; everything below next_free is known to be used
+            offset = next_free
+            while offset < pool.num_addresses and (
+                    not self._usable(pool, offset) or bitmap[offset >> 3] & (1 << (offset & 7))):
+                offset += 1
+            if offset >= pool.num_addresses:
+                raise ValueError(f"Address pool {pool} is exhausted")
+            self._pools[pool][1] = offset + 1
+
+        bitmap[offset >> 3] |= 1 << (offset & 7)
+        self.assignments[node] = (pool, offset)
+        return pool[offset]
+
+    def allocate_all(self, nodes):
+        """
+        Allocate addresses for many nodes: first every node that can get its
+        preferred address, then the remaining ones, so that a node without
+        a usable preference never takes the preferred address of another.
+
+        Args:
+            nodes: List of (node, isd, preferred) tuples
+        """
+        deferred = []
+        for node, isd, preferred in nodes:
+            pool = self.pool(isd)
+            bitmap = self._pools.get(pool, [None])[0]
+            if (preferred is not None and self._usable(pool, preferred)
+                    and not (bitmap and bitmap[preferred >> 3] & (1 << (preferred & 7)))):
+                self.allocate(node, isd, preferred)
+            else:
+                deferred.append((node, isd))
+        for node, isd in deferred:
+            self.allocate(node, isd)
+
+    def prefixlen(self, node):
+        """
+        Prefix length of the pool a node's address belongs to.
+        """
+        return self.assignments[node][0].prefixlen
+
+    def pools(self):
+        """
+        All pools of this allocator.
+        """
+        return [self.network] + list(self.isd_networks.values())
 
 
 class PortAllocator:
     """
     Manages port allocation for border router interfaces.
-    Ensures unique ports are assigned to each link between nodes.
+
+    Both ends of a link use the same port, which only has to be unique on
+    the underlay hosts of the two ends, so every host has its own namespace:
+    a bitmap of the ports used on it. A link gets the lowest port that is
+    free on both hosts and not excluded, so the number of links scales with
+    the number of hosts instead of the 16-bit port space.
     """
-    def __init__(self, base_port=50000):
+    def __init__(self, base_port=DEFAULT_BASE_PORT, max_port=65535, excluded=()):
+        """
+        Args:
+            base_port: First port to assign
+            max_port: Last port to assign
+            excluded: (first, last) port ranges to never assign, e.g.
+                ports reserved for other services
+        """
+        if not 0 < base_port <= max_port <= 65535:
+            raise ValueError(f"Invalid port range {base_port}-{max_port}")
         self.base_port = base_port
-        self.next_port = base_port
+        self.max_port = max_port
+        # Bitmap of the excluded ports, by offset from base_port
+        self._excluded = bytearray((max_port - base_port) // 8 + 1)
+        for first, last in excluded:
+            for port in range(max(first, base_port), min(last, max_port) + 1):
+                offset = port - base_port
+                self._excluded[offset >> 3] |= 1 << (offset & 7)
+        # Key: host, Value: [bitmap of used port offsets (grown as needed),
+        # lowest possibly free offset]
+        self._hosts = {}
         # Key: (smaller_node, larger_node, link_index), Value: port
         self.port_assignments = {}
 
-    def get_port(self, node_a, node_b, link_index=0):
+    def _is_used(self, host, offset):
+        bitmap = self._hosts[host][0]
+        return (offset >> 3) < len(bitmap) and bitmap[offset >> 3] & (1 << (offset & 7))
+
+    def _use(self, host, offset):
+        state = self._hosts[host]
+        bitmap = state[0]
+        if (offset >> 3) >= len(bitmap):
+            bitmap.extend(bytes((offset >> 3) + 1 - len(bitmap)))
+        bitmap[offset >> 3] |= 1 << (offset & 7)
+        while self._is_used(host, state[1]):
+            state[1] += 1
+
+    def get_port(self, node_a, node_b, link_index=0, host_a=None, host_b=None):
         """
-        Get a unique port for a specific link between two nodes.
+        Get the port of a specific link between two nodes, assigning it on
+        first use.
 
         Args:
-            node_a: First node number
-            node_b: Second node number
+            node_a: ISDAS of the first node
+            node_b: ISDAS of the second node
             link_index: Index for multiple links between same nodes (0, 1, 2, ...)
+            host_a: Underlay host of node_a's end of the link (default: node_a)
+            host_b: Underlay host of node_b's end of the link (default: node_b)
 
         Returns:
-            Unique port number for this specific link
+            Port number for this specific link, unique on both hosts
+
+        Raises:
+            ValueError: if no port is free on both hosts
         """
         # Create canonical key (sorted order for consistency)
         smaller = min(node_a, node_b)
@@ -213,292 +602,2278 @@ class PortAllocator:
         if key in self.port_assignments:
             return self.port_assignments[key]
 
-        # Assign new port
-        port = self.next_port
+        host_a = node_a if host_a is None else host_a
+        host_b = node_b if host_b is None else host_b
+        for host in (host_a, host_b):
+            if host not in self._hosts:
+                self._hosts[host] = [bytearray(), 0]
+
+        # Lowest port that is free on both hosts and not excluded
+        offset = max(self._hosts[host_a][1], self._hosts[host_b][1])
+        last = self.max_port - self.base_port
+        while offset <= last and (self._excluded[offset >> 3] & (1 << (offset & 7))
+                                  or self._is_used(host_a, offset)
+                                  or self._is_used(host_b, offset)):
+            offset += 1
+        if offset > last:
+            raise ValueError(f"No free port between {self.base_port} and {self.max_port} "
+                             f"on both {host_a} and {host_b}")
+
+        self._use(host_a, offset)
+        self._use(host_b, offset)
+        port = self.base_port + offset
         self.port_assignments[key] = port
-        self.next_port += 1
 
         return port
 
 
-def update_topology_json(file_path, node_number, port_allocator):
+def parse_port_ranges(text):
+    """
+    Parse a port list such as 50100-50199,51000 into (first, last) ranges.
+
+    Raises:
+        ValueError: if text is not a valid port list
+    """
+    ranges = []
+    for part in text.split(','):
+        first, sep, last = part.strip().partition('-')
+        if not first.isdigit() or (sep and not last.isdigit()):
+            raise ValueError(f"Invalid port list {text!r}")
+        ranges.append((int(first), int(last if sep else first)))
+    return ranges
+
+
+class AS:
+    """
+    An AS of the topology, as described by its topology.json.
+    """
+    __slots__ = ('isd_as', 'as_name', 'node_name', 'core',
+                 'source_dir', 'topology', 'border_routers',
+                 'address', 'prefixlen', 'internal_address', 'internal_prefixlen',
+                 'internal_domain', 'service_address', 'shard', 'shared_certs')
+
+    def __init__(self, isd_as, as_name, core, source_dir, topology):
+        # ISDAS of the AS, the key of the AS in every index
+        self.isd_as = isd_as
+        self.as_name = as_name
+        self.node_name = isd_as.node_name
+        self.core = core
+        self.source_dir = source_dir
+        # Parsed topology.json, never modified after loading
+        self.topology = topology
+        # Key: border router name, Value: BorderRouter (in topology.json order)
+        self.border_routers = {}
+        # Addresses on the inter-AS and internal networks, see TopologyModel.assign_addresses
+        self.address = None
+        self.prefixlen = None
+        self.internal_address = None
+        self.internal_prefixlen = None
+        # Collision domain of the internal network
+        self.internal_domain = "net_1"
+        # Address the AS's own services (BR internal/API, CS, SD) bind to
+        self.service_address = None
+        # Shard (lab) the AS's nodes belong to, see TopologyModel.partition
+        self.shard = 0
+        # Content address of certs/ under shared/certs/ if the TRCs are shared
+        # between the nodes instead of copied into each (see certs_digest)
+        self.shared_certs = None
+
+    @property
+    def isd(self):
+        return self.isd_as.isd
+
+    def interfaces(self):
+        """
+        Iterate over the interfaces of all border routers of this AS,
+        in topology.json order.
+        """
+        for router in self.border_routers.values():
+            yield from router.interfaces.values()
+
+    def neighbors(self, relation):
+        """
+        The ISD-ASes at the other end of this AS's links of a relation
+        ('parent', 'child', 'core' or 'peer', see link_to in topology.json).
+        """
+        return [interface.remote_isd_as for interface in self.interfaces()
+                if interface.remote_isd_as is not None
+                and interface.data.get('link_to', '').lower() == relation]
+
+
+class BorderRouter:
     """
-    Update topology.json file with proper IP addresses and port assignments.
+    A border router of an AS and its interfaces.
+    """
+    __slots__ = ('name', 'asys', 'internal_addr', 'interfaces', 'node_name',
+                 'address', 'prefixlen', 'internal_address', 'internal_prefixlen',
+                 'service_address', 'instance', 'internal_port', 'api_port', 'cpu')
+
+    def __init__(self, name, asys, internal_addr):
+        self.name = name
+        self.asys = asys
+        self.internal_addr = internal_addr
+        # Key: interface ID, Value: Interface (in topology.json order)
+        self.interfaces = {}
+        # Own Kathara node and addresses, only with one container per border
+        # router (see TopologyModel.split_border_routers)
+        self.node_name = None
+        self.address = None
+        self.prefixlen = None
+        self.internal_address = None
+        self.internal_prefixlen = None
+        self.service_address = None
+        # Process in the AS node (br1, br2, ...) with its own ports and
+        # optional CPU, only with one process per border router (see
+        # TopologyModel.split_router_processes)
+        self.instance = None
+        self.internal_port = None
+        self.api_port = None
+        self.cpu = None
+
+
+class Interface:
+    """
+    A border router interface, i.e. one end of an inter-AS link.
+    """
+    __slots__ = ('ifid', 'router', 'remote_isd_as', 'data', 'link', 'address')
+
+    def __init__(self, ifid, router, remote_isd_as, data):
+        self.ifid = ifid
+        self.router = router
+        # ISDAS of the remote AS, None if topology.json does not name it
+        self.remote_isd_as = remote_isd_as
+        # Interface entry of topology.json, never modified after loading
+        self.data = data
+        self.link = None
+        # Address on the link's own network, only with point-to-point links
+        # (see TopologyModel.assign_link_networks)
+        self.address = None
+
+    @property
+    def remote(self):
+        """
+        The interface at the other end of the link, or None if unknown.
+        """
+        if self.link is None:
+            return None
+        return self.link.b if self.link.a is self else self.link.a
+
+
+class Link:
+    """
+    An inter-AS link between two border router interfaces.
+
+    The endpoints are ordered canonically: a is the interface with the
+    smaller (ISD-AS, interface ID).
+    """
+    __slots__ = ('a', 'b', 'index', 'domain', 'network')
+
+    def __init__(self, a, b):
+        if _endpoint_key(b) < _endpoint_key(a):
+            a, b = b, a
+        self.a = a
+        self.b = b
+        # Index among the links between the same pair of nodes (0, 1, 2, ...)
+        self.index = 0
+        # Kathara collision domain and /31 network, only with point-to-point links
+        self.domain = None
+        self.network = None
+        a.link = self
+        b.link = self
+
+    @property
+    def node_pair(self):
+        return (self.a.router.asys.isd_as, self.b.router.asys.isd_as)
+
+
+def _endpoint_key(interface):
+    return (interface.router.asys.isd_as, interface.ifid)
+
+
+class TopologyModel:
+    """
+    The complete topology, loaded once from all topology.json files together
+    with ifids.yml and as_list.yml, and indexed for O(1) lookups.
+    """
+    def __init__(self):
+        # Key: ISDAS (e.g., 1-ff00:0:110), Value: AS (sorted by ISD-AS)
+        self.ases = {}
+        # Key: AS directory name (e.g., ASff00_0_110), Value: AS
+        self.ases_by_name = {}
+        # Key: (ISDAS, interface ID), Value: Interface
+        self.interfaces = {}
+        # Key: (smaller_node, larger_node), Value: list of Links between the nodes
+        self.links_by_pair = {}
+        self.links = []
+        # Pools of the inter-AS network, see assign_addresses
+        self.address_pools = []
+        # One of UNDERLAY_MODES, see assign_link_networks
+        self.underlay = "shared"
+        # One of BR_MODES, see split_border_routers
+        self.br_mode = "consolidated"
+        # Number of shards (labs) the topology is split into, see partition
+        self.shards = 1
+        # Lab instance the names are scoped to, see set_instance
+        self.instance = None
+
+    @classmethod
+    def load(cls, source_base):
+        """
+        Load the topology from a generated SCION topology directory.
+
+        Args:
+            source_base: Directory containing the generated AS directories
+
+        Returns:
+            TopologyModel of all AS directories that contain a topology.json
+
+        Raises:
+            ValueError: if a topology.json cannot be read, or an ISD-AS is
+                invalid or used by two AS directories
+        """
+        model = cls()
+        core_ases = set()
+        as_list_file = source_base / "as_list.yml"
+        if as_list_file.exists():
+            with open(as_list_file, 'r') as f:
+                core_ases = {ISDAS.parse(isd_as)
+                             for isd_as in (yaml.load(f, Loader=YAML_LOADER) or {}).get('Core') or []}
+
+        ases = []
+        for as_dir in find_as_dirs(source_base):
+            topology_file = as_dir / "topology.json"
+            if not topology_file.exists():
+                continue
+
+            try:
+                with open(topology_file, 'r') as f:
+                    topology = json.load(f)
+                isd_as = ISDAS.parse(topology['isd_as'])
+            except (OSError, ValueError) as e:
+                raise ValueError(f"Cannot read {topology_file}: {e}") from e
+            except (KeyError, TypeError) as e:
+                raise ValueError(f"Cannot read {topology_file}: no valid isd_as") from e
+            core = isd_as in core_ases or 'core' in topology.get('attributes', [])
+            ases.append(AS(isd_as, as_dir.name, core, as_dir, topology))
+
+        ases.sort(key=lambda asys: asys.isd_as)
+        for asys in ases:
+            if asys.isd_as in model.ases:
+                raise ValueError(f"ISD-AS {asys.isd_as} is used by both "
+                                 f"{model.ases[asys.isd_as].as_name} and {asys.as_name}")
+            model.add_as(asys)
+
+        ifids_file = source_base / "ifids.yml"
+        if ifids_file.exists():
+            with open(ifids_file, 'r') as f:
+                model.link_from_ifids(yaml.load(f, Loader=YAML_LOADER) or {})
+        else:
+            model.link_in_order()
+
+        model.index_links()
+        return model
+
+    def add_as(self, asys):
+        self.ases[asys.isd_as] = asys
+        self.ases_by_name[asys.as_name] = asys
+
+        for br_name, br_data in asys.topology.get('border_routers', {}).items():
+            router = BorderRouter(br_name, asys, br_data.get('internal_addr'))
+            asys.border_routers[br_name] = router
+
+            for interface_id, interface_data in br_data.get('interfaces', {}).items():
+                remote_isd_as = interface_data.get('isd_as')
+                if remote_isd_as is not None:
+                    remote_isd_as = ISDAS.parse(remote_isd_as)
+                interface = Interface(int(interface_id), router, remote_isd_as, interface_data)
+                router.interfaces[interface.ifid] = interface
+                self.interfaces[(asys.isd_as, interface.ifid)] = interface
+
+    def add_link(self, a, b):
+        link = Link(a, b)
+        self.links.append(link)
+        self.links_by_pair.setdefault(link.node_pair, []).append(link)
+        return link
+
+    def index_links(self):
+        """
+        Number parallel links between the same pair of nodes by their interface
+        IDs and sort all links canonically, so that link indices (and the
+        ports derived from them) do not depend on the order in which the
+        topology was read or the ASes are converted.
+        """
+        for links in self.links_by_pair.values():
+            links.sort(key=lambda link: (link.a.ifid, link.b.ifid))
+            for index, link in enumerate(links):
+                link.index = index
+        self.links.sort(key=lambda link: (link.node_pair, link.index))
+
+    def link_from_ifids(self, ifids):
+        """
+        Connect interfaces as listed in ifids.yml, which maps
+        "<local br> <local ifid>" to "<remote br> <remote ifid>" per ISD-AS.
+        """
+        for isd_as, entries in ifids.items():
+            isd_as = ISDAS.parse(isd_as)
+            for local, remote in (entries or {}).items():
+                local_ifid = int(str(local).split()[-1])
+                remote_ifid = int(str(remote).split()[-1])
+                interface = self.interfaces.get((isd_as, local_ifid))
+                if interface is None or interface.link is not None:
+                    continue
+                remote_interface = self.interfaces.get((interface.remote_isd_as, remote_ifid))
+                if remote_interface is None or remote_interface.link is not None:
+                    continue
+                self.add_link(interface, remote_interface)
+
+    def link_in_order(self):
+        """
+        Connect interfaces without ifids.yml: parallel links between two ASes
+        are paired up in interface ID order on both sides.
+        """
+        pending = {}
+        for (isd_as, ifid), interface in sorted(self.interfaces.items()):
+            if interface.remote_isd_as not in self.ases:
+                continue
+            key = (isd_as, interface.remote_isd_as)
+            candidates = pending.get((interface.remote_isd_as, isd_as))
+            if candidates:
+                self.add_link(candidates.pop(0), interface)
+            else:
+                pending.setdefault(key, []).append(interface)
+
+    def assign_addresses(self, allocator, internal_allocator):
+        """
+        Give every AS an address on the inter-AS and the internal network.
+        The AS number is the preferred host part, so small labs keep
+        addresses like 10.0.0.110 for AS 110.
+
+        Args:
+            allocator: AddressAllocator of the inter-AS network
+            internal_allocator: AddressAllocator of the internal network
+        """
+        self.address_pools = allocator.pools()
+        nodes = [(asys.node_name, asys.isd, asys.isd_as.short_number) for asys in self.ases.values()]
+        nodes += [(router.node_name, router.asys.isd, None) for router in self.router_nodes()]
+        allocator.allocate_all(nodes)
+        internal_allocator.allocate_all(nodes)
+        for asys in self.ases.values():
+            asys.address = str(allocator.allocate(asys.node_name))
+            asys.prefixlen = allocator.prefixlen(asys.node_name)
+            asys.internal_address = str(internal_allocator.allocate(asys.node_name))
+            asys.internal_prefixlen = internal_allocator.prefixlen(asys.node_name)
+            asys.service_address = asys.address
+        for router in self.router_nodes():
+            router.address = str(allocator.allocate(router.node_name))
+            router.prefixlen = allocator.prefixlen(router.node_name)
+            router.internal_address = str(internal_allocator.allocate(router.node_name))
+            router.internal_prefixlen = internal_allocator.prefixlen(router.node_name)
+            # Services in different containers talk over the internal network
+            router.service_address = router.internal_address
+            router.asys.service_address = router.asys.internal_address
+
+    def split_border_routers(self):
+        """
+        Deploy every border router in its own Kathara node (as1_120_br1,
+        as1_120_br2, ... in topology.json order) instead of consolidating
+        them into the AS node. Must be called before assign_addresses.
+        """
+        self.br_mode = "container"
+        for asys in self.ases.values():
+            for i, router in enumerate(asys.border_routers.values(), 1):
+                router.node_name = f"{asys.node_name}_br{i}"
+
+    def split_router_processes(self, cpus=None):
+        """
+        Run every border router as its own scion-router process in the AS
+        node (br1, br2, ... in topology.json order) instead of consolidating
+        them. Each process keeps the internal port of its router and gets
+        its own API port, both unique within the AS.
+
+        Args:
+            cpus: CPUs to pin the processes to, assigned round-robin over
+                all routers of the lab; None to leave them unpinned
+        """
+        self.br_mode = "process"
+        routers = 0
+        for asys in self.ases.values():
+            used_ports = set()
+            for i, router in enumerate(asys.border_routers.values(), 1):
+                router.instance = f"br{i}"
+                port = BR_API_PORT
+                if router.internal_addr is not None:
+                    port = int(router.internal_addr.rsplit(':', 1)[1])
+                while port in used_ports:
+                    port += 1
+                router.internal_port = port
+                used_ports.add(port)
+
+            api_port = BR_API_PORT
+            for router in asys.border_routers.values():
+                while api_port in used_ports:
+                    api_port += 1
+                router.api_port = api_port
+                used_ports.add(api_port)
+                if cpus:
+                    router.cpu = cpus[routers % len(cpus)]
+                routers += 1
+
+    def tiers(self):
+        """
+        Boot tiers of the ASes: 0 for the core ASes, then one more than
+        the parent's for the children, breadth first over the parent-child
+        links. ASes that cannot be reached from the core come last.
+
+        Returns:
+            Dictionary mapping every ISDAS to its tier
+        """
+        tiers = {isd_as: 0 for isd_as, asys in self.ases.items() if asys.core}
+        tier = list(tiers)
+        while tier:
+            children = []
+            for isd_as in tier:
+                for child in self.ases[isd_as].neighbors('child'):
+                    if child in self.ases and child not in tiers:
+                        tiers[child] = tiers[isd_as] + 1
+                        children.append(child)
+            tier = children
+        last = max(tiers.values(), default=-1) + 1
+        return {isd_as: tiers.get(isd_as, last) for isd_as in self.ases}
+
+    def scoped(self, name):
+        """
+        Scope a node or collision domain name to the lab instance, e.g.
+        i2_net_0 for net_0 in instance 2.
+        """
+        return name if self.instance is None else f"i{self.instance}_{name}"
+
+    def set_instance(self, instance):
+        """
+        Scope the node and collision domain names to a lab instance, so
+        that several instances of the topology can run on one host. Must
+        be called before any other names are derived from the AS nodes'.
+
+        Args:
+            instance: Lab instance ID
+        """
+        self.instance = instance
+        for asys in self.ases.values():
+            asys.node_name = self.scoped(asys.node_name)
+            asys.internal_domain = self.scoped(asys.internal_domain)
+
+    def router_nodes(self):
+        """
+        Iterate over the border routers that have their own Kathara node.
+        """
+        if self.br_mode == "container":
+            for asys in self.ases.values():
+                yield from asys.border_routers.values()
+
+    def assign_intra_as_networks(self, internal_pool, prefixlen=DEFAULT_INTRA_AS_PREFIXLEN):
+        """
+        Give every AS its own internal collision domain and subnet, carved
+        from internal_pool in AS order, and bind the AS's services on its
+        first address there instead of on the inter-AS network. Border
+        routers in their own nodes get the following addresses; the
+        subnets grow as needed to fit the AS with the most routers.
+
+        Args:
+            internal_pool: CIDR pool to take the per-AS subnets from
+            prefixlen: Prefix length of each AS's subnet
+        """
+        internal_pool = ipaddress.IPv4Network(internal_pool)
+        hosts = 1
+        if self.br_mode == "container":
+            hosts += max((len(asys.border_routers) for asys in self.ases.values()), default=0)
+        while prefixlen > 0 and (1 << (32 - prefixlen)) - 2 < hosts:
+            prefixlen -= 1
+        if prefixlen < internal_pool.prefixlen or prefixlen > 30:
+            raise ValueError(f"Cannot split {internal_pool} into /{prefixlen} subnets")
+        subnet_size = 1 << (32 - prefixlen)
+        if subnet_size * len(self.ases) > internal_pool.num_addresses:
+            raise ValueError(f"Address pool {internal_pool} is too small for {len(self.ases)} "
+                             f"/{prefixlen} subnets")
+
+        base = int(internal_pool.network_address)
+        router_nodes = self.br_mode == "container"
+        for i, asys in enumerate(self.ases.values()):
+            subnet = ipaddress.IPv4Network((base + i * subnet_size, prefixlen))
+            asys.internal_domain = f"intra_{asys.node_name}"
+            asys.internal_address = str(subnet[1])
+            asys.internal_prefixlen = prefixlen
+            asys.service_address = asys.internal_address
+            for j, router in enumerate(asys.border_routers.values() if router_nodes else ()):
+                router.internal_address = str(subnet[2 + j])
+                router.internal_prefixlen = prefixlen
+                router.service_address = router.internal_address
+
+    def assign_link_networks(self, link_pool):
+        """
+        Switch to point-to-point links: give every link its own collision
+        domain and /31 network from link_pool.
+
+        Args:
+            link_pool: CIDR pool to take the /31 link networks from
+        """
+        link_pool = ipaddress.IPv4Network(link_pool)
+        if 2 * len(self.links) > link_pool.num_addresses:
+            raise ValueError(f"Link pool {link_pool} is too small for {len(self.links)} links")
+
+        self.underlay = "p2p"
+        base = int(link_pool.network_address)
+        for i, link in enumerate(self.links):
+            link.domain = self.scoped(f"link_{i}")
+            link.network = ipaddress.IPv4Network((base + 2 * i, 31))
+            link.a.address = str(link.network[0])
+            link.b.address = str(link.network[1])
+
+    def partition(self, shards, imbalance=SHARD_IMBALANCE, passes=8):
+        """
+        Split the AS graph into shards, one lab per host, minimising the
+        links between shards while balancing their load, estimated by the
+        node degree (1 + number of links) of their ASes.
+
+        Starts from contiguous chunks of a breadth-first order of the graph,
+        which keeps neighbours together, then greedily moves ASes to the
+        shard most of their links lead to, as long as that cuts fewer links
+        and keeps every shard within the allowed imbalance.
+
+        Args:
+            shards: Number of shards
+            imbalance: Allowed load of a shard above the average, as a fraction
+            passes: Maximum number of refinement passes
+
+        Returns:
+            List of the links between shards, in canonical order
+        """
+        if not 1 <= shards <= len(self.ases):
+            raise ValueError(f"Cannot split {len(self.ases)} ASes into {shards} shards")
+        self.shards = shards
+
+        neighbours = {isd_as: [] for isd_as in self.ases}
+        for link in self.links:
+            node_a, node_b = link.node_pair
+            neighbours[node_a].append(node_b)
+            neighbours[node_b].append(node_a)
+        weight = {isd_as: 1 + len(adjacent) for isd_as, adjacent in neighbours.items()}
+        total = sum(weight.values())
+
+        # Breadth-first order, starting each component at its heaviest AS
+        order = []
+        visited = set()
+        for start in sorted(self.ases, key=lambda isd_as: (-weight[isd_as], isd_as)):
+            if start in visited:
+                continue
+            visited.add(start)
+            queue = [start]
+            for isd_as in queue:
+                order.append(isd_as)
+                for neighbour in sorted(set(neighbours[isd_as])):
+                    if neighbour not in visited:
+                        visited.add(neighbour)
+                        queue.append(neighbour)
+
+        load = [0] * shards
+        done = 0
+        for isd_as in order:
+            shard = min(shards - 1, (2 * done + weight[isd_as]) * shards // (2 * total))
+            self.ases[isd_as].shard = shard
+            load[shard] += weight[isd_as]
+            done += weight[isd_as]
+
+        max_load = (1 + imbalance) * total / shards
+        for _ in range(passes):
+            moved = False
+            for isd_as in order:
+                asys = self.ases[isd_as]
+                counts = [0] * shards
+                for neighbour in neighbours[isd_as]:
+                    counts[self.ases[neighbour].shard] += 1
+                best = max(range(shards), key=lambda shard: (counts[shard], shard == asys.shard, -shard))
+                if (counts[best] > counts[asys.shard]
+                        and load[best] + weight[isd_as] <= max_load):
+                    load[asys.shard] -= weight[isd_as]
+                    load[best] += weight[isd_as]
+                    asys.shard = best
+                    moved = True
+            if not moved:
+                break
+
+        return self.cut_links()
+
+    def cut_links(self):
+        """
+        The links between ASes of different shards, in canonical order.
+        """
+        return [link for link in self.links
+                if link.a.router.asys.shard != link.b.router.asys.shard]
+
+    def cross_shard_domains(self):
+        """
+        The collision domains that span several shards and have to be
+        bridged between their hosts: net_0 on the shared inter-AS network
+        (among the shards with links to other shards), or the domains of
+        the cut point-to-point links.
+
+        Returns:
+            List of (collision domain, VXLAN ID, sorted shards) tuples
+        """
+        cut = self.cut_links()
+        if self.underlay == "p2p":
+            domains = [(link.domain, sorted({link.a.router.asys.shard, link.b.router.asys.shard}))
+                       for link in cut]
+        else:
+            shards = sorted({link.a.router.asys.shard for link in cut}
+                            | {link.b.router.asys.shard for link in cut})
+            domains = [(self.scoped("net_0"), shards)] if cut else []
+        base_vni = VXLAN_BASE_VNI + (self.instance or 0) * INSTANCE_VNI_STRIDE
+        return [(domain, base_vni + i, shards) for i, (domain, shards) in enumerate(domains)]
+
+
+def iter_interface_links(asys):
+    """
+    Iterate over the inter-AS links of all border router interfaces of an AS.
 
     Args:
-        file_path: Path to topology.json file
-        node_number: Node number for this AS
-        port_allocator: PortAllocator instance for managing port assignments
+        asys: AS whose interfaces to iterate
+
+    Yields:
+        (interface, remote_as, link_index) for every interface with an
+        underlay and a link to another AS of the topology, where link_index
+        numbers multiple links between the same pair of nodes (0, 1, 2, ...)
+        identically on both ends of each link
     """
-    with open(file_path, 'r') as f:
-        topology = json.load(f)
-    if 'test_dispatcher' in topology:
-        del(topology['test_dispatcher'])
-
-    # Update control_service addresses
-    if 'control_service' in topology:
-        for service_name, service_data in topology['control_service'].items():
-            if 'addr' in service_data:
-                # Extract port from existing address
-                port = service_data['addr'].split(':')[1]
-                ip = node_to_ip(node_number)
-                service_data['addr'] = f'10.0.0.{ip}:{port}'
-
-    # Update discovery_service addresses
-    if 'discovery_service' in topology:
-        for service_name, service_data in topology['discovery_service'].items():
-            if 'addr' in service_data:
-                # Extract port from existing address
-                port = service_data['addr'].split(':')[1]
-                ip = node_to_ip(node_number)
-                service_data['addr'] = f'10.0.0.{ip}:{port}'
-
-    # Update border_routers addresses and consolidate into a single border router
-    if 'border_routers' in topology:
-        # Track link indices for multiple connections between same node pairs
-        # Key: (smaller_node, larger_node), Value: current link index
-        link_counters = {}
-
-        # Collect all interfaces from all border routers
-        all_interfaces = {}
-        consolidated_internal_addr = None
-
-        for br_name, br_data in topology['border_routers'].items():
-            # Keep the first internal_addr we find (or use the last one)
-            if 'internal_addr' in br_data:
-                # Extract port from existing address
-                port = br_data['internal_addr'].split(':')[1]
-                ip = node_to_ip(node_number)
-                consolidated_internal_addr = f'10.0.0.{ip}:{port}'
-
-            # Collect all interfaces from this border router
-            if 'interfaces' in br_data:
-                for interface_id, interface_data in br_data['interfaces'].items():
-                    # Copy the interface data
-                    all_interfaces[interface_id] = interface_data
-
-        # Now process all collected interfaces
-        for interface_id, interface_data in all_interfaces.items():
-            if 'underlay' in interface_data:
-                underlay = interface_data['underlay']
-
-                # Get remote node for port calculation
-                remote_node = None
-                if 'isd_as' in interface_data:
-                    remote_isd_as = interface_data['isd_as']
-                    remote_node = extract_node_from_isd_as(remote_isd_as)
-
-                if remote_node is not None:
-                    # Create a canonical key for the node pair (sorted order)
-                    node_pair = (min(node_number, remote_node), max(node_number, remote_node))
-
-                    # Get the link index for this pair (or 0 if first link)
-                    link_index = link_counters.get(node_pair, 0)
-
-                    # Increment counter for next potential link between same nodes
-                    link_counters[node_pair] = link_index + 1
-
-                    # Get a unique port for this connection with link index
-                    connection_port = port_allocator.get_port(node_number, remote_node, link_index)
-
-                    # Update local address
-                    if 'local' in underlay:
-                        ip = node_to_ip(node_number)
-                        underlay['local'] = f'10.0.0.{ip}:{connection_port}'
-
-                    # Update remote address (uses same port as it's the same connection)
-                    if 'remote' in underlay:
-                        remote_ip = node_to_ip(remote_node)
-                        underlay['remote'] = f'10.0.0.{remote_ip}:{connection_port}'
-
-        # Replace all border routers with a single consolidated one
-        topology['border_routers'] = {
-            'br': {
-                'internal_addr': consolidated_internal_addr,
-                'interfaces': all_interfaces
-            }
-        }
+    for interface in asys.interfaces():
+        if 'underlay' not in interface.data or interface.link is None:
+            continue
+        yield interface, interface.remote.router.asys, interface.link.index
+
+
+def preallocate_ports(model, port_allocator):
+    """
+    Resolve every port assignment up front, in the canonical link order.
+    Ports are unique per underlay host, so addresses (and point-to-point
+    link networks) must be assigned first; without addresses, ports are
+    unique per AS.
+
+    Workers converting ASes in parallel then only look up existing
+    assignments and never mutate the shared allocator state.
+
+    Args:
+        model: TopologyModel to assign ports for
+        port_allocator: PortAllocator instance to fill
+
+    Raises:
+        ValueError: if the port range is exhausted on some host
+    """
+    for link in model.links:
+        node_a, node_b = link.node_pair
+        port_allocator.get_port(node_a, node_b, link.index,
+                                _underlay_host(link.a), _underlay_host(link.b))
+
+
+def _hardlink_file(src, dst):
+    os.link(src, dst)
 
-    # Write back to file
-    with open(file_path, 'w') as f:
-        json.dump(topology, f, indent=2)
-        f.write('\n')  # Add trailing newline
 
+def _reflink_file(src, dst):
+    import fcntl
 
-def generate_kathara_configs(dest_base, as_to_node):
+    with open(src, 'rb') as src_fd, open(dst, 'wb') as dst_fd:
+        fcntl.ioctl(dst_fd.fileno(), FICLONE, src_fd.fileno())
+    shutil.copystat(src, dst)
+
+
+def _with_copy_fallback(link_file):
+    """
+    Wrap a per-file link function so that it falls back to a regular copy,
+    e.g. when source and destination are on different filesystems or the
+    filesystem does not support reflinks.
+    """
+    def copy_function(src, dst):
+        try:
+            link_file(src, dst)
+        except (OSError, ImportError):
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            shutil.copy2(src, dst)
+    return copy_function
+
+
+def certs_digest(certs_dir):
+    """
+    Content address of a certs/ directory: a hash over the names and
+    contents of its files, equal for all ASes with the same TRCs.
     """
-    Generate Kathara lab.conf and startup scripts for all nodes.
+    digest = hashlib.sha256()
+    for path in sorted(p for p in certs_dir.rglob('*') if p.is_file()):
+        digest.update(str(path.relative_to(certs_dir)).encode() + b'\0')
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+    return digest.hexdigest()[:16]
+
+
+def copy_tree(src_dir, dst_dir, link_mode="copy"):
+    """
+    Materialise src_dir at dst_dir, replacing whatever is there.
+
+    Args:
+        src_dir: Source directory
+        dst_dir: Destination directory
+        link_mode: One of LINK_MODES:
+            copy: regular recursive copy
+            hardlink: hard link every file (os.link)
+            reflink: copy-on-write clone of every file (FICLONE)
+            symlink: a single absolute symlink to src_dir, which only
+                resolves where the host filesystem is visible (netns backend)
+            Link modes fall back to copying when linking is not possible.
+    """
+    if dst_dir.is_symlink():
+        dst_dir.unlink()
+    elif dst_dir.exists():
+        shutil.rmtree(dst_dir)
+
+    if link_mode == "symlink":
+        try:
+            os.symlink(Path(src_dir).resolve(), dst_dir, target_is_directory=True)
+            return
+        except OSError:
+            link_mode = "copy"
+
+    if link_mode == "hardlink":
+        shutil.copytree(src_dir, dst_dir, copy_function=_with_copy_fallback(_hardlink_file))
+    elif link_mode == "reflink":
+        shutil.copytree(src_dir, dst_dir, copy_function=_with_copy_fallback(_reflink_file))
+    else:
+        shutil.copytree(src_dir, dst_dir)
+
+
+def as_fingerprint(model, asys, port_allocator, options=None):
+    """
+    Compute a content hash over everything that determines an AS's output.
+
+    Covers the converter version, the node name, the conversion options,
+    every file in the AS directory and the ports of all links touching the
+    AS (its link neighbourhood), which depend on the rest of the topology.
+
+    Args:
+        model: TopologyModel the AS belongs to
+        asys: AS to fingerprint
+        port_allocator: PortAllocator with all ports already assigned
+        options: Dictionary of conversion options that affect the output
+
+    Returns:
+        Hex digest identifying this AS's conversion inputs
+    """
+    as_dir = asys.source_dir
+    digest = hashlib.sha256()
+    digest.update(f"{CONVERTER_VERSION}\0{asys.node_name}\0{asys.address}\0"
+                  f"{asys.service_address}\0{asys.shard}\0".encode())
+    digest.update(json.dumps(options or {}, sort_keys=True).encode() + b'\0')
+
+    for path in sorted(p for p in as_dir.rglob('*') if p.is_file()):
+        digest.update(str(path.relative_to(as_dir)).encode() + b'\0')
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+
+    for router in asys.border_routers.values():
+        digest.update(f"{router.name}:{router.node_name}:{router.service_address}:{router.instance}:"
+                      f"{router.internal_port}:{router.api_port}:{router.cpu}\0".encode())
+
+    for interface, remote_as, link_index in iter_interface_links(asys):
+        port = port_allocator.get_port(asys.isd_as, remote_as.isd_as, link_index)
+        local, remote = underlay_addresses(interface, port)
+        digest.update(f"{interface.ifid}:{remote_as.node_name}:{local}:{remote}\0".encode())
+
+    return digest.hexdigest()
+
+
+def load_manifest(dest_base):
+    """
+    Load the conversion manifest of a previous run.
+
+    Returns:
+        Dictionary mapping AS names to their recorded fingerprints, empty if
+        there is no usable manifest or it was written by another converter version
+    """
+    manifest_path = dest_base / MANIFEST_NAME
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get('converter_version') != CONVERTER_VERSION:
+        return {}
+    return {as_name: entry['fingerprint'] for as_name, entry in manifest.get('ases', {}).items()}
+
+
+def write_manifest(dest_base, as_to_node, fingerprints):
+    """
+    Write the conversion manifest, replacing any previous one atomically.
 
     Args:
         dest_base: Base directory for the Kathara lab
         as_to_node: Dictionary mapping AS names to node names
+        fingerprints: Dictionary mapping AS names to their input fingerprints
+    """
+    manifest = {
+        'converter_version': CONVERTER_VERSION,
+        'ases': {
+            as_name: {'node': as_to_node[as_name], 'fingerprint': fingerprint}
+            for as_name, fingerprint in fingerprints.items()
+        },
+    }
+
+    write_atomic(dest_base / MANIFEST_NAME, json.dumps(manifest, indent=2, sort_keys=True) + '\n')
+
+
+def _with_address(addr, ip):
     """
-    # Start building lab.conf content
-    labfile = """LAB_DESCRIPTION="SCION single collision domain topology"
+    Replace the host of a host:port address, keeping the port.
+    """
+    port = addr.split(':')[-1]
+    return f'{ip}:{port}'
+
+
+def _underlay_host(interface):
+    if interface.address is not None:
+        return interface.address
+    router = interface.router
+    return router.address if router.node_name is not None else router.asys.address
+
+
+def underlay_addresses(interface, port):
+    """
+    Local and remote underlay address of an interface with a link: the
+    addresses of the nodes running the routers on the shared inter-AS
+    network, or the link's own /31 addresses with point-to-point links.
+    Both sides use the same port.
+
+    Returns:
+        (local, remote) host:port addresses
+    """
+    return f'{_underlay_host(interface)}:{port}', f'{_underlay_host(interface.remote)}:{port}'
+
+
+def update_topology_json(file_path, model, asys, port_allocator):
+    """
+    Write topology.json for an AS with proper IP addresses and port assignments.
+
+    Args:
+        file_path: Path of the topology.json file to write
+        model: TopologyModel the AS belongs to
+        asys: AS to render the topology for
+        port_allocator: PortAllocator instance for managing port assignments
+    """
+    ip = asys.service_address
+
+    # Underlay addresses of every interface with a link, by interface ID
+    underlays = {}
+    for interface, remote_as, link_index in iter_interface_links(asys):
+        # Get a unique port for this connection with link index
+        connection_port = port_allocator.get_port(asys.isd_as, remote_as.isd_as, link_index)
+
+        local, remote = underlay_addresses(interface, connection_port)
+        underlay = dict(interface.data['underlay'])
+        if 'local' in underlay:
+            underlay['local'] = local
+        if 'remote' in underlay:
+            underlay['remote'] = remote
+        underlays[interface.ifid] = underlay
+
+    topology = {}
+    for key, value in asys.topology.items():
+        if key == 'test_dispatcher':
+            continue
+
+        if key in ('control_service', 'discovery_service'):
+            # Update service addresses
+            value = {
+                service_name: {
+                    field: _with_address(field_value, ip) if field == 'addr' else field_value
+                    for field, field_value in service_data.items()
+                }
+                for service_name, service_data in value.items()
+            }
+
+        elif key == 'border_routers' and model.br_mode != "consolidated":
+            # Keep every border router, in its own node or process
+            value = {}
+            for router in asys.border_routers.values():
+                interfaces = {}
+                for interface in router.interfaces.values():
+                    interface_data = dict(interface.data)
+                    if interface.ifid in underlays:
+                        interface_data['underlay'] = underlays[interface.ifid]
+                    interfaces[str(interface.ifid)] = interface_data
+                internal_addr = router.internal_addr
+                if router.instance is not None:
+                    internal_addr = f'{ip}:{router.internal_port}'
+                elif internal_addr is not None:
+                    internal_addr = _with_address(internal_addr, router.service_address)
+                value[router.name] = {'internal_addr': internal_addr, 'interfaces': interfaces}
+
+        elif key == 'border_routers':
+            # Consolidate all border routers into a single one
+            consolidated_internal_addr = None
+            all_interfaces = {}
+            for router in asys.border_routers.values():
+                # Keep the last internal_addr we find
+                if router.internal_addr is not None:
+                    consolidated_internal_addr = _with_address(router.internal_addr, ip)
+
+                for interface in router.interfaces.values():
+                    interface_data = dict(interface.data)
+                    if interface.ifid in underlays:
+                        interface_data['underlay'] = underlays[interface.ifid]
+                    all_interfaces[str(interface.ifid)] = interface_data
+
+            value = {
+                'br': {
+                    'internal_addr': consolidated_internal_addr,
+                    'interfaces': all_interfaces
+                }
+            }
+
+        topology[key] = value
+
+    write_atomic(file_path, json.dumps(topology, indent=2) + '\n')  # Add trailing newline
+
+
+LAB_CONF_HEADER = """LAB_DESCRIPTION="SCION single collision domain topology"
 LAB_VERSION=1.0
 LAB_AUTHOR="Network Security Group, ETH Zurich"
 LAB_WEB="https://netsec.ethz.ch"
 """
 
-    # Sort nodes by AS number for consistent ordering
-    sorted_nodes = []
-    for as_name, node_name in as_to_node.items():
-        as_num = extract_as_number(as_name)
-        sorted_nodes.append((as_num, node_name))
-    sorted_nodes.sort()
-
-    # Generate configuration for each node
-    for node_idx, (as_num, node_name) in enumerate(sorted_nodes):
-        ip = node_to_ip(as_num)
-
-        # Add to lab.conf
-        labfile += f"""
-# Config for {node_name}
-{node_name}[0]=net_0
-{node_name}[1]=net_1
-{node_name}[image]="kathara/scion-local"
+
+# systemd units of the SCION services of an AS, in start order
+SCION_SERVICES = ("scion-dispatcher", "scion-router", "scion-control", "scion-daemon")
+
+
+class LabNode:
+    """
+    A Kathara node of the lab, as rendered into lab.conf and its startup script.
+    """
+    __slots__ = ('name', 'devices', 'loopback', 'routes', 'services', 'cpus', 'probes',
+                 'tier', 'depends', 'shared_certs')
+
+    def __init__(self, name, services):
+        self.name = name
+        # (collision domain, address, prefix length) of eth0, eth1, ...
+        self.devices = []
+        # Addresses on lo, used by the node's own services only
+        self.loopback = []
+        # Networks routed on-link over eth0
+        self.routes = []
+        # systemd units of the SCION services, in start order
+        self.services = services
+        # Key: service, Value: CPU the service is pinned to
+        self.cpus = {}
+        # Key: service, Value: (address, port) of the API answering once it is ready
+        self.probes = {}
+        # Boot tier (see TopologyModel.tiers) and the nodes to start before this one
+        self.tier = 0
+        self.depends = []
+        # Directory under shared/certs/ that /etc/scion/certs links to, if any
+        self.shared_certs = None
+
+
+def _attach_underlay(node, model, address, prefixlen, interfaces):
+    """
+    Attach a node running border routers to the inter-AS network.
+
+    On the shared inter-AS network, the node address is on eth0 and pools
+    other than the node's own (e.g. of other ISDs) are routed on-link over
+    eth0. With point-to-point links, every link of the given interfaces
+    gets its own device after the ones the node already has.
+    """
+    if model.underlay == "p2p":
+        for interface in interfaces:
+            if interface.link is not None:
+                node.devices.append((interface.link.domain, interface.address, 31))
+        return
+
+    own_pool = ipaddress.ip_interface(f"{address}/{prefixlen}").network
+    node.devices.insert(0, (model.scoped("net_0"), address, prefixlen))
+    node.routes = [pool for pool in model.address_pools if pool != own_pool]
+
+
+def iter_lab_nodes(model, shard=None):
+    """
+    Describe the Kathara nodes of a topology: one per AS (sorted by
+    ISD-AS), followed by its border router nodes when every router has
+    its own container.
+
+    Args:
+        model: TopologyModel of the converted topology
+        shard: Only describe the nodes of this shard (default: all)
+
+    Yields:
+        LabNode of every node
+    """
+    def node_names(asys):
+        return [asys.node_name] + [router.node_name for router in asys.border_routers.values()
+                                   if router.node_name is not None]
+
+    tiers = model.tiers()
+    for asys in model.ases.values():
+        if shard is not None and asys.shard != shard:
+            continue
+        routers = [router for router in asys.border_routers.values() if router.node_name is not None]
+        # Start after the parents, which are on earlier tiers unless unreachable from the core
+        tier = tiers[asys.isd_as]
+        depends = [name for parent in dict.fromkeys(asys.neighbors('parent'))
+                   if parent in model.ases and tiers[parent] < tier
+                   and (shard is None or model.ases[parent].shard == shard)
+                   for name in node_names(model.ases[parent])]
+        internal = (asys.internal_domain, asys.internal_address, asys.internal_prefixlen)
+
+        probes = {"scion-control": (asys.service_address, CS_API_PORT),
+                  "scion-daemon": (asys.service_address, SD_API_PORT)}
+
+        if routers:
+            node = LabNode(asys.node_name, [service for service in SCION_SERVICES
+                                            if service != "scion-router"])
+            node.probes = probes
+            node.tier, node.depends = tier, depends
+            node.shared_certs = asys.shared_certs
+            node.devices.append(internal)
+            yield node
+        else:
+            services = []
+            for service in SCION_SERVICES:
+                if service == "scion-router":
+                    # One unit per router process, see router_unit
+                    services += [f"scion-router-{router.instance}"
+                                 for router in asys.border_routers.values()
+                                 if router.instance is not None] or [service]
+                else:
+                    services.append(service)
+            node = LabNode(asys.node_name, services)
+            node.cpus = {f"scion-router-{router.instance}": router.cpu
+                         for router in asys.border_routers.values() if router.cpu is not None}
+            node.probes = {"scion-router": (asys.service_address, BR_API_PORT), **probes}
+            node.tier, node.depends = tier, depends
+            node.shared_certs = asys.shared_certs
+            for router in asys.border_routers.values():
+                if router.instance is not None:
+                    node.probes[f"scion-router-{router.instance}"] = (asys.service_address,
+                                                                      router.api_port)
+            node.devices.append(internal)
+            if model.underlay == "p2p":
+                # The node address is only used by the node's own services
+                node.loopback.append(asys.address)
+            _attach_underlay(node, model, asys.address, asys.prefixlen, asys.interfaces())
+            yield node
+
+        for router in routers:
+            node = LabNode(router.node_name, ["scion-router"])
+            node.probes = {"scion-router": (router.service_address, BR_API_PORT)}
+            node.tier, node.depends = tier, depends
+            node.shared_certs = asys.shared_certs
+            node.devices.append((asys.internal_domain, router.internal_address,
+                                 router.internal_prefixlen))
+            _attach_underlay(node, model, router.address, router.prefixlen,
+                             router.interfaces.values())
+            yield node
+
+
+def router_unit(router):
+    """
+    Render the systemd unit of a border router process in the AS node,
+    optionally pinned to its CPU with taskset.
+    """
+    taskset = f"/usr/bin/taskset -c {router.cpu} " if router.cpu is not None else ""
+    return f"""[Unit]
+Description=SCION Router {router.name}
+Documentation=https://docs.scion.org
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+Type=simple
+ExecStart={taskset}/usr/bin/scion-router --config /etc/scion/{router.instance}.toml
+RemainAfterExit=False
+
+[Install]
+WantedBy=multi-user.target
 """
 
-        # Generate startup script
-        startup_script = f"""# === Startup Script for {node_name} ===
 
-ip address add 10.0.0.{ip}/24 dev eth0
-ip address add 192.168.0.{ip}/24 dev eth1
+def parse_cpu_list(text):
+    """
+    Parse a CPU list such as 0-3,6 into a list of CPU numbers.
+
+    Raises:
+        ValueError: if text is not a valid CPU list
+    """
+    cpus = []
+    for part in text.split(','):
+        first, sep, last = part.strip().partition('-')
+        if not first.isdigit() or (sep and not last.isdigit()):
+            raise ValueError(f"Invalid CPU list {text!r}")
+        cpus.extend(range(int(first), int(last if sep else first) + 1))
+    if not cpus:
+        raise ValueError(f"Invalid CPU list {text!r}")
+    return cpus
+
+
+def has_databases(node):
+    """
+    Whether a node runs services with databases (control service, daemon).
+    """
+    return "scion-control" in node.services or "scion-daemon" in node.services
+
+
+def startup_script(node, warm_start=False):
+    """
+    Render the Kathara .startup script of a node.
+
+    The services are started in dependency order (dispatcher, routers,
+    control service, daemon), each only once the previous one is ready:
+    its API answers on its probe address, or systemd reports it active
+    if it has none. Probes back off exponentially from 0.1s to 5s, and
+    the node gives up after READINESS_TIMEOUT seconds overall. A ready
+    node creates /var/run/scion-ready.
+
+    With warm_start, the node first restores the snapshot of its
+    databases from /shared/snapshots/, unless it is stale (see
+    snapshot.py). Before that, /etc/scion/certs is linked to the shared
+    TRCs if the node has no copy of its own (see write_shared_certs).
+    """
+    lines = [f"ip address add {address}/32 dev lo" for address in node.loopback]
+    lines += [f"ip address add {address}/{prefixlen} dev eth{i}"
+              for i, (_, address, prefixlen) in enumerate(node.devices)]
+    lines += [f"ip route add {network} dev eth0" for network in node.routes]
+    addresses = "\n".join(lines) + "\n"
+    starts = ""
+    for service in node.services:
+        address, port = node.probes.get(service, ("", ""))
+        starts += f"systemctl start {service}.service\n"
+        starts += f"wait_ready {service} {address} {port}".rstrip() + " || exit 1\n"
+    certs = ""
+    if node.shared_certs is not None:
+        certs = ("\n# Link the TRCs shared by all nodes\n"
+                 f"rm -rf /etc/scion/certs && ln -s /shared/certs/{node.shared_certs} /etc/scion/certs\n")
+    restore = ""
+    if warm_start and has_databases(node):
+        restore = ("\n# Restore the database snapshot, if not stale\n"
+                   f"python3 /shared/snapshot.py restore {node.name}\n")
+    return f"""# === Startup Script for {node.name} ===
+
+{addresses}{certs}
+[ -s /etc/scion/topology.json ] || {{ echo "/etc/scion/topology.json is missing" >&2; exit 1; }}
+{restore}
+deadline=$(( $(date +%s) + {READINESS_TIMEOUT} ))
+
+# Usage: wait_ready <service> [<address> <port>]
+wait_ready() {{
+    delay=100
+    while true; do
+        if [ -n "$2" ]; then
+            timeout 1 bash -c "</dev/tcp/$2/$3" 2>/dev/null && return 0
+        else
+            systemctl is-active --quiet "$1.service" && return 0
+        fi
+        if [ "$(date +%s)" -ge "$deadline" ]; then
+            echo "$1 not ready after {READINESS_TIMEOUT}s" >&2
+            systemctl status --no-pager "$1.service"
+            return 1
+        fi
+        sleep "$((delay / 1000)).$((delay % 1000 / 100))"
+        delay=$((delay * 2 > 5000 ? 5000 : delay * 2))
+    done
+}}
 
 # Start SCION services
-systemctl start scion-dispatcher.service
-systemctl start scion-router.service
-systemctl start scion-control.service
-systemctl start scion-daemon.service
-systemctl status scion-*.service
+{starts}touch /var/run/scion-ready
+echo "{node.name} ready"
 
 """
+
+
+def iter_lab_conf(dest_base, model, image=DEFAULT_IMAGE, log=print, shard=None, warm_start=False):
+    """
+    Produce the nodes of the lab one by one: write each node's startup
+    script and yield its lab.conf entry, so lab.conf can be streamed to
+    disk in linear time and constant memory.
+
+    Args:
+        dest_base: Base directory for the Kathara lab
+        model: TopologyModel of the converted topology
+        image: Docker image of the nodes
+        log: Function to report progress with
+        shard: Only produce the nodes of this shard (default: all)
+        warm_start: Restore the nodes' database snapshots, see startup_script
+
+    Yields:
+        Chunks of lab.conf, starting with the lab metadata
+    """
+    yield LAB_CONF_HEADER
+
+    for node in iter_lab_nodes(model, shard):
         # Write startup script
-        startup_path = dest_base / f"{node_name}.startup"
-        with open(startup_path, "w") as fd:
-            fd.write(startup_script)
-        print(f"  Generated {node_name}.startup")
+        with open(dest_base / f"{node.name}.startup", "w") as fd:
+            fd.write(startup_script(node, warm_start))
+        log(f"  Generated {node.name}.startup")
+
+        attachments = "".join(f"{node.name}[{i}]={domain}\n"
+                              for i, (domain, _, _) in enumerate(node.devices))
+        yield f"""
+# Config for {node.name}
+{attachments}{node.name}[image]="{image}"
+"""
 
-    # Write lab.conf
-    lab_conf_path = dest_base / "lab.conf"
-    with open(lab_conf_path, "w") as fd:
-        fd.write(labfile)
-    print(f"\n✓ Generated lab.conf")
 
+# Command lines of the SCION services in the netns backend. The dispatcher
+# is only needed by legacy applications and not started there.
+SERVICE_COMMANDS = {
+    "scion-dispatcher": None,
+    "scion-router": "scion-router --config /etc/scion/br.toml",
+    "scion-control": "scion-control --config /etc/scion/cs.toml",
+    "scion-daemon": "scion-daemon --config /etc/scion/sd.toml",
+}
 
-def main():
-    script_dir = Path(__file__).parent
-    source_base = script_dir / "input_scion" / "gen"
-    dest_base = script_dir / "KatharaLab"
 
-    # Check if source exists
-    if not source_base.exists():
-        print(f"Error: Source directory {source_base} does not exist!")
-        return
+def service_command(node, service):
+    """
+    Command line running a service of a node directly, without systemd,
+    or None if the service is not needed outside of containers.
+    """
+    if service.startswith("scion-router-"):
+        # One router process of --br-mode process, see router_unit
+        command = f"scion-router --config /etc/scion/{service[len('scion-router-'):]}.toml"
+    else:
+        command = SERVICE_COMMANDS[service]
+    if command is not None and service in node.cpus:
+        command = f"taskset -c {node.cpus[service]} {command}"
+    return command
 
-    # Create destination base if it doesn't exist
-    dest_base.mkdir(parents=True, exist_ok=True)
 
-    # Automatically build AS to node mapping
-    as_to_node = build_as_to_node_mapping(source_base)
+def netns_script(model, shard=None, shard_hosts=None, warm_start=False):
+    """
+    Render the launcher of the netns backend: a shell script that runs a
+    lab without containers, every node in its own Linux network namespace
+    with its node directory bind-mounted on /etc/scion.
 
-    if not as_to_node:
-        print("Error: No AS directories found in source!")
-        return
+    Collision domains with two nodes become a veth pair between them;
+    larger ones a bridge in a hub namespace that every member connects to
+    with a veth pair. Collision domains spanning several shards are
+    bridged to the other shards' hosts over VXLAN.
+
+    Args:
+        model: TopologyModel of the converted topology
+        shard: Only run the nodes of this shard (default: all)
+        shard_hosts: Underlay addresses of the shards' hosts, by shard
+        warm_start: Restore the nodes' database snapshots from shared/snapshots/
+    """
+    nodes = list(iter_lab_nodes(model, shard))
+    cross_shard = {}
+    if shard is not None:
+        cross_shard = {domain: (vni, shards) for domain, vni, shards in model.cross_shard_domains()
+                       if shard in shards}
+
+    # Key: collision domain, Value: list of (node, device) in node order
+    members = {}
+    for node in nodes:
+        for i, (domain, _, _) in enumerate(node.devices):
+            members.setdefault(domain, []).append((node.name, f"eth{i}"))
+    bridges = {domain: f"b{i}" for i, domain in enumerate(
+        domain for domain, ends in members.items() if len(ends) > 2 or domain in cross_shard)}
+
+    lines = [
+        "#!/bin/sh",
+        "# SCION lab in Linux network namespaces, without containers",
+        "# Usage (as root): ./lab.sh start | stop",
+        "set -e",
+        'LAB_DIR=$(cd "$(dirname "$0")" && pwd)',
+        f"HUB={model.scoped('scion_hub')}",
+        'UNDERLAY_DEV="${UNDERLAY_DEV:-eth0}"',
+    ]
+    for other in sorted({other for _, shards in cross_shard.values() for other in shards} - {shard}):
+        if shard_hosts:
+            lines.append(f'SHARD_{other}_HOST="${{SHARD_{other}_HOST:-{shard_hosts[other]}}}"')
+        else:
+            lines.append(f'SHARD_{other}_HOST="${{SHARD_{other}_HOST:?address of the host of shard {other}}}"')
+    lines += [
+        "",
+        "# Usage: run <node> <service> <command>...",
+        "run() {",
+        "    node=$1 service=$2",
+        "    shift 2",
+        "    ip netns exec \"$node\" unshare --mount --propagation private "
+        "sh -c 'mount --bind \"$0\" /etc/scion && exec \"$@\"' \"$LAB_DIR/$node/etc/scion\" \"$@\" "
+        "> \"$LAB_DIR/logs/$node-$service.log\" 2>&1 &",
+        '    echo $! > "$LAB_DIR/run/$node-$service.pid"',
+        "}",
+        "",
+        "# Usage: wait_ready <node> <service> <address> <port>",
+        "wait_ready() {",
+        f"    delay=100 deadline=$(( $(date +%s) + {READINESS_TIMEOUT} ))",
+        '    until ip netns exec "$1" timeout 1 bash -c "</dev/tcp/$3/$4" 2>/dev/null; do',
+        '        if [ "$(date +%s)" -ge "$deadline" ]; then',
+        f'            echo "Warning: $2 of $1 not ready after {READINESS_TIMEOUT}s" >&2',
+        "            return 0",
+        "        fi",
+        '        sleep "$((delay / 1000)).$((delay % 1000 / 100))"',
+        "        delay=$((delay * 2 > 5000 ? 5000 : delay * 2))",
+        "    done",
+        "}",
+        "",
+        "start() {",
+        '    mkdir -p /etc/scion "$LAB_DIR/logs" "$LAB_DIR/run"',
+        '    ip netns add "$HUB"',
+    ]
+    for domain, bridge in bridges.items():
+        lines.append(f'    ip -n "$HUB" link add {bridge} type bridge  # {domain}')
+        lines.append(f'    ip -n "$HUB" link set {bridge} up')
+        if domain in cross_shard:
+            vni, shards = cross_shard[domain]
+            lines.append(f'    ip link add vx{vni} type vxlan id {vni} dstport {VXLAN_PORT} dev "$UNDERLAY_DEV"')
+            for other in shards:
+                if other != shard:
+                    lines.append(f'    bridge fdb append 00:00:00:00:00:00 dev vx{vni} dst "$SHARD_{other}_HOST"')
+            lines.append(f'    ip link set vx{vni} netns "$HUB"')
+            lines.append(f'    ip -n "$HUB" link set vx{vni} master {bridge} up')
+
+    for node in nodes:
+        lines.append(f"    ip netns add {node.name}")
+        lines.append(f"    ip -n {node.name} link set lo up")
+
+    # Connect the nodes: directly, or through the bridge of the domain
+    port = 0
+    for domain, ends in members.items():
+        if domain in bridges:
+            for node_name, device in ends:
+                lines.append(f'    ip link add {device} netns {node_name} type veth peer name p{port} netns "$HUB"')
+                lines.append(f'    ip -n "$HUB" link set p{port} master {bridges[domain]} up')
+                port += 1
+        elif len(ends) == 2:
+            (node_a, device_a), (node_b, device_b) = ends
+            lines.append(f"    ip link add {device_a} netns {node_a} type veth peer name {device_b} netns {node_b}")
+        else:
+            # A domain with a single node (e.g. an isolated internal network)
+            node_name, device = ends[0]
+            lines.append(f"    ip -n {node_name} link add {device} type dummy")
+
+    for node in nodes:
+        for address in node.loopback:
+            lines.append(f"    ip -n {node.name} address add {address}/32 dev lo")
+        for i, (_, address, prefixlen) in enumerate(node.devices):
+            lines.append(f"    ip -n {node.name} address add {address}/{prefixlen} dev eth{i}")
+            lines.append(f"    ip -n {node.name} link set eth{i} up")
+        for network in node.routes:
+            lines.append(f"    ip -n {node.name} route add {network} dev eth0")
+
+    for node in nodes:
+        if node.shared_certs is not None:
+            lines.append(f'    ln -sfn "$LAB_DIR/shared/certs/{node.shared_certs}" '
+                         f'"$LAB_DIR/{node.name}/etc/scion/certs"')
+    if warm_start:
+        for node in nodes:
+            if has_databases(node):
+                lines.append(f'    python3 "$LAB_DIR/shared/snapshot.py" restore {node.name} '
+                             f'--config-dir "$LAB_DIR/{node.name}/etc/scion"')
+
+    # Start the nodes tier by tier, each once the previous tier answers
+    tiers = sorted({node.tier for node in nodes})
+    for tier in tiers:
+        tier_nodes = [node for node in nodes if node.tier == tier]
+        for node in tier_nodes:
+            for service in node.services:
+                command = service_command(node, service)
+                if command is not None:
+                    lines.append(f"    run {node.name} {service} {command}")
+        if tier != tiers[-1]:
+            for node in tier_nodes:
+                for service in node.services:
+                    if service in node.probes and service_command(node, service) is not None:
+                        address, port = node.probes[service]
+                        lines.append(f"    wait_ready {node.name} {service} {address} {port}")
+
+    lines += [
+        "}",
+        "",
+        "stop() {",
+        '    for pid_file in "$LAB_DIR"/run/*.pid; do',
+        '        [ -e "$pid_file" ] || continue',
+        '        kill "$(cat "$pid_file")" 2>/dev/null || true',
+        '        rm -f "$pid_file"',
+        "    done",
+    ]
+    lines += [f"    ip netns del {node.name} 2>/dev/null || true" for node in nodes]
+    lines += [
+        '    ip netns del "$HUB" 2>/dev/null || true',
+        "}",
+        "",
+        'case "$1" in',
+        "    start) start ;;",
+        "    stop) stop ;;",
+        '    *) echo "Usage: $0 start | stop" >&2; exit 2 ;;',
+        "esac",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def lab_dir(dest_base, model, asys):
+    """
+    Directory of the lab an AS's nodes belong to: dest_base itself, or
+    its shard's lab (shard_0, shard_1, ...) in a sharded lab.
+    """
+    if model.shards == 1:
+        return dest_base
+    return dest_base / f"shard_{asys.shard}"
 
-    print(f"Found {len(as_to_node)} AS directories:")
-    for as_name, node_name in sorted(as_to_node.items()):
-        print(f"  {as_name} => {node_name}")
-    print()
 
-    # Create a shared port allocator for all nodes
-    port_allocator = PortAllocator(base_port=50000)
+def vxlan_script(model, shard, hosts=None):
+    """
+    Render the script bridging a shard's cross-shard collision domains
+    to the other shards' hosts over VXLAN, to be run as root on the
+    shard's host after kathara lstart.
 
-    # Process each AS
-    for as_name, node_name in as_to_node.items():
-        as_dir = source_base / as_name
-        node_dir = dest_base / node_name / "etc" / "scion"
+    Args:
+        model: Partitioned TopologyModel
+        shard: Shard to render the script for
+        hosts: Underlay addresses of the shards' hosts, by shard; the
+            script requires SHARD_<n>_HOST variables without them
+    """
+    lines = [
+        "#!/bin/sh",
+        f"# VXLAN bridging of shard {shard} to the other shards, run as root after kathara lstart",
+        "set -e",
+        'UNDERLAY_DEV="${UNDERLAY_DEV:-eth0}"',
+    ]
+    for other in range(model.shards):
+        if other == shard:
+            continue
+        if hosts:
+            lines.append(f'SHARD_{other}_HOST="${{SHARD_{other}_HOST:-{hosts[other]}}}"')
+        else:
+            lines.append(f'SHARD_{other}_HOST="${{SHARD_{other}_HOST:?address of the host of shard {other}}}"')
+    lines += [
+        "",
+        "# Usage: attach <collision domain> <VXLAN ID> <remote host>...",
+        "attach() {",
+        "    domain=$1 vni=$2",
+        "    shift 2",
+        "    # Kathara labels its networks with the full collision domain name, and",
+        "    # its Docker network plugin names the bridge of a network",
+        "    # kt-<first 12 characters of its ID>",
+        "    network=$(docker network ls --no-trunc --filter label=app=kathara "
+        "--filter \"label=name=$domain\" --format '{{.ID}}')",
+        '    [ -n "$network" ] || { echo "No Docker network for $domain" >&2; exit 1; }',
+        '    [ "$(echo "$network" | wc -l)" -eq 1 ] || '
+        '{ echo "Several Docker networks for $domain" >&2; exit 1; }',
+        f'    ip link add "vx$vni" type vxlan id "$vni" dstport {VXLAN_PORT} dev "$UNDERLAY_DEV"',
+        '    for remote in "$@"; do',
+        '        bridge fdb append 00:00:00:00:00:00 dev "vx$vni" dst "$remote"',
+        "    done",
+        '    ip link set "vx$vni" master "kt-$(echo "$network" | cut -c1-12)" up',
+        "}",
+        "",
+    ]
+    for domain, vni, shards in model.cross_shard_domains():
+        if shard in shards:
+            remotes = " ".join(f'"$SHARD_{other}_HOST"' for other in shards if other != shard)
+            lines.append(f"attach {domain} {vni} {remotes}")
+    return "\n".join(lines) + "\n"
+
+
+def lab_dep(model, shard=None):
+    """
+    Render the Kathara lab.dep of a lab, which starts the core ASes'
+    nodes first and then the other ASes' nodes after their parents',
+    tier by tier.
+
+    Args:
+        model: TopologyModel of the converted topology
+        shard: Only render the nodes of this shard (default: all)
+    """
+    return "".join(f"{node.name}: {' '.join(node.depends)}\n"
+                   for node in iter_lab_nodes(model, shard) if node.depends)
+
+
+def write_shared_scripts(lab_base, model, warm_start=False):
+    """
+    Install the convergence collector (convergence.py) into a lab's
+    shared/ directory, with the control service and daemon API
+    addresses of all ASes in convergence_targets.json, and the snapshot
+    script (snapshot.py) for warm starts.
+
+    Args:
+        lab_base: Directory of the lab
+        model: TopologyModel of the converted topology
+        warm_start: Install snapshot.py
+    """
+    shared_dir = lab_base / "shared"
+    shared_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(Path(__file__).parent / "convergence.py", shared_dir / "convergence.py")
+    if warm_start:
+        shutil.copyfile(Path(__file__).parent / "snapshot.py", shared_dir / "snapshot.py")
+    targets = [{"isd_as": str(asys.isd_as), "node": asys.node_name, "core": asys.core,
+                "cs": f"{asys.service_address}:{CS_API_PORT}",
+                "sd": f"{asys.service_address}:{SD_API_PORT}"}
+               for asys in model.ases.values()]
+    write_atomic(shared_dir / "convergence_targets.json", json.dumps(targets, indent=2) + "\n")
+
+
+def prune_stale_nodes(dest_base, model, log=print, backend="kathara"):
+    """
+    Remove what a previous conversion into dest_base left behind that the
+    current lab no longer has: node directories and .startup scripts of
+    nodes that no longer exist (e.g. border router nodes after a change of
+    --br-mode), the files in the remaining node directories that the
+    current configuration no longer produces (see as_output_paths), the
+    shared certs/ directories no AS links to anymore, the labs of shards
+    that no longer exist, and the files of the other backend or of an
+    unsharded lab.
 
-        if not as_dir.exists():
-            print(f"Warning: {as_name} directory not found, skipping...")
+    Args:
+        dest_base: Base directory for the Kathara lab
+        model: TopologyModel of the converted topology
+        log: Function to report progress with
+        backend: One of BACKENDS
+    """
+    stale_files = {"lab.sh"} if backend == "kathara" else {"lab.conf", "lab.dep", "vxlan.sh"}
+    shards = [None] if model.shards == 1 else list(range(model.shards))
+    lab_dirs = {dest_base if shard is None else dest_base / f"shard_{shard}": shard
+                for shard in shards}
+
+    for path in dest_base.glob("shard_*"):
+        if path.is_dir() and path not in lab_dirs:
+            shutil.rmtree(path)
+            log(f"  Removed stale {path.name}/")
+    if dest_base not in lab_dirs:
+        # Sharded now, so the top level holds no lab
+        lab_dirs[dest_base] = -1
+        for name in ("lab.conf", "lab.dep", "lab.sh", "shared"):
+            path = dest_base / name
+            if path.is_dir():
+                shutil.rmtree(path)
+            elif path.exists():
+                path.unlink()
+            else:
+                continue
+            log(f"  Removed stale {name}")
+
+    for lab_base, shard in lab_dirs.items():
+        nodes = {node.name for node in iter_lab_nodes(model, shard)} if shard != -1 else set()
+        for path in lab_base.iterdir():
+            if path.is_dir() and (path / "etc" / "scion").is_dir() and path.name not in nodes:
+                shutil.rmtree(path)
+            elif path.suffix == ".startup" and (path.stem not in nodes or backend != "kathara"):
+                path.unlink()
+            elif path.name in stale_files and path.is_file():
+                path.unlink()
+            else:
+                continue
+            log(f"  Removed stale {path.relative_to(dest_base)}")
+
+    shared_certs = {lab_base: set() for lab_base, shard in lab_dirs.items() if shard != -1}
+    for asys in model.ases.values():
+        lab_base = lab_dir(dest_base, model, asys)
+        keep = set(as_output_paths(model, asys, lab_base))
+        node_names = [asys.node_name]
+        if model.br_mode == "container":
+            node_names += [router.node_name for router in asys.border_routers.values()]
+        if asys.shared_certs is not None:
+            shared_certs[lab_base].add(asys.shared_certs)
+            # Linked by the startup scripts
+            keep |= {lab_base / name / "etc" / "scion" / "certs" for name in node_names}
+        for name in node_names:
+            if (lab_base / name).is_dir():
+                _prune_outputs(lab_base / name, keep, dest_base, log)
+
+    for lab_base, digests in shared_certs.items():
+        certs_dir = lab_base / "shared" / "certs"
+        if not certs_dir.is_dir():
             continue
+        for path in certs_dir.iterdir():
+            if path.name not in digests:
+                shutil.rmtree(path)
+                log(f"  Removed stale {path.relative_to(dest_base)}")
+        if not any(certs_dir.iterdir()):
+            certs_dir.rmdir()
 
-        # Extract AS number from node_name (e.g., "AS_110" -> 110)
-        node_number = int(node_name.replace('as_', ''))
-        ip = node_to_ip(node_number)
 
-        print(f"Processing {as_name} => {node_name} (10.0.0.{ip})")
+def _prune_outputs(directory, keep, dest_base, log):
+    """
+    Remove everything under a node directory that is neither in keep nor
+    under a path in keep, except files the services write at run time,
+    and the directories this leaves empty.
+    """
+    for path in directory.iterdir():
+        if path in keep or RUNTIME_FILE_PATTERN.fullmatch(path.name):
+            continue
+        if path.is_dir() and not path.is_symlink():
+            _prune_outputs(path, keep, dest_base, log)
+            if any(path.iterdir()):
+                continue
+            path.rmdir()
+        else:
+            path.unlink()
+        log(f"  Removed stale {path.relative_to(dest_base)}")
 
-        # Create node directory
-        node_dir.mkdir(parents=True, exist_ok=True)
 
-        # Copy directories: certs, crypto, keys
-        for dir_name in ["certs", "crypto", "keys"]:
-            src_dir = as_dir / dir_name
-            dst_dir = node_dir  / dir_name
+def generate_kathara_configs(dest_base, model, image=DEFAULT_IMAGE, log=print, shard_hosts=None,
+                             backend="kathara", warm_start=False):
+    """
+    Generate Kathara lab.conf, lab.dep and startup scripts for all nodes,
+    one lab per shard with the VXLAN bridging script of its cross-shard collision
+    domains if the topology is partitioned. With the netns backend,
+    generate the lab.sh launcher of each lab instead. Every lab gets the
+    convergence collector in its shared/ directory, and with warm_start
+    the snapshot script its nodes restore their databases with.
 
-            if src_dir.exists():
-                if dst_dir.exists():
-                    shutil.rmtree(dst_dir)
-                shutil.copytree(src_dir, dst_dir)
-                print(f"  Copied {dir_name}/")
+    Args:
+        dest_base: Base directory for the Kathara lab
+        model: TopologyModel of the converted topology
+        image: Docker image of the nodes
+        log: Function to report progress with
+        shard_hosts: Underlay addresses of the shards' hosts, by shard
+        backend: One of BACKENDS
+        warm_start: Restore the nodes' database snapshots before starting
+            their services
+    """
+    if backend == "netns":
+        shards = [None] if model.shards == 1 else range(model.shards)
+        for shard in shards:
+            shard_dir = dest_base if shard is None else dest_base / f"shard_{shard}"
+            shard_dir.mkdir(parents=True, exist_ok=True)
+            write_atomic(shard_dir / "lab.sh", netns_script(model, shard, shard_hosts, warm_start))
+            os.chmod(shard_dir / "lab.sh", 0o755)
+            write_shared_scripts(shard_dir, model, warm_start)
+            log(f"  Generated {shard_dir.relative_to(dest_base) / 'lab.sh'}")
+        return
+
+    if model.shards == 1:
+        write_atomic(dest_base / "lab.conf", iter_lab_conf(dest_base, model, image, log,
+                                                                warm_start=warm_start))
+        write_atomic(dest_base / "lab.dep", lab_dep(model))
+        write_shared_scripts(dest_base, model, warm_start)
+        log(f"\n✓ Generated lab.conf and lab.dep")
+        return
+
+    for shard in range(model.shards):
+        shard_dir = dest_base / f"shard_{shard}"
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        write_atomic(shard_dir / "lab.conf", iter_lab_conf(shard_dir, model, image, log, shard,
+                                                                 warm_start))
+        write_atomic(shard_dir / "lab.dep", lab_dep(model, shard))
+        write_shared_scripts(shard_dir, model, warm_start)
+        write_atomic(shard_dir / "vxlan.sh", vxlan_script(model, shard, shard_hosts))
+        os.chmod(shard_dir / "vxlan.sh", 0o755)
+        log(f"\n✓ Generated shard_{shard}/lab.conf, lab.dep and vxlan.sh")
+
+
+def _copy_scion_dirs(asys, node_dir, link_mode, log):
+    """
+    Copy the certs/, crypto/ and keys/ directories of an AS into a node
+    directory, except certs/ when it is shared (see write_shared_certs).
+    """
+    for dir_name in ["certs", "crypto", "keys"]:
+        src_dir = asys.source_dir / dir_name
+        dst_dir = node_dir / dir_name
+
+        if dir_name == "certs" and asys.shared_certs is not None:
+            # Linked to the shared copy by the node's startup script
+            if dst_dir.is_symlink():
+                dst_dir.unlink()
+            elif dst_dir.exists():
+                shutil.rmtree(dst_dir)
+            log.append(f"  Shared {dir_name}/ (shared/certs/{asys.shared_certs})")
+            continue
+
+        if src_dir.exists():
+            copy_tree(src_dir, dst_dir, link_mode)
+            if link_mode == "copy":
+                log.append(f"  Copied {dir_name}/")
             else:
-                print(f"  Warning: {dir_name}/ not found in {as_name}")
+                log.append(f"  Copied {dir_name}/ ({link_mode})")
+        else:
+            log.append(f"  Warning: {dir_name}/ not found in {asys.as_name}")
+
 
-        # Find and rename br*.toml to br.toml
+def as_output_paths(model, asys, dest_base):
+    """
+    The files and directories convert_as writes for an AS, in its own node
+    directory and those of its border router nodes, given the inputs the
+    AS directory has.
+
+    Args:
+        model: TopologyModel the AS belongs to
+        asys: AS to list the outputs of
+        dest_base: Base directory of the AS's lab (see lab_dir)
+    """
+    as_dir = asys.source_dir
+    node_dir = dest_base / asys.node_name / "etc" / "scion"
+    scion_dirs = [name for name in ("certs", "crypto", "keys") if (as_dir / name).exists()
+                  and not (name == "certs" and asys.shared_certs is not None)]
+
+    paths = [node_dir / "topology.json"] + [node_dir / name for name in scion_dirs]
+    if any(as_dir.glob("cs*.toml")):
+        paths.append(node_dir / "cs.toml")
+    if (as_dir / "sd.toml").exists():
+        paths.append(node_dir / "sd.toml")
+
+    if model.br_mode == "container":
+        for router in asys.border_routers.values():
+            router_dir = dest_base / router.node_name / "etc" / "scion"
+            paths += [router_dir / "topology.json"] + [router_dir / name for name in scion_dirs]
+            if (as_dir / f"{router.name}.toml").exists():
+                paths.append(router_dir / "br.toml")
+    elif model.br_mode == "process":
+        unit_dir = dest_base / asys.node_name / "etc" / "systemd" / "system"
+        for router in asys.border_routers.values():
+            paths.append(unit_dir / f"scion-router-{router.instance}.service")
+            if (as_dir / f"{router.name}.toml").exists():
+                paths.append(node_dir / f"{router.instance}.toml")
+    elif any(as_dir.glob("br*.toml")):
+        paths.append(node_dir / "br.toml")
+    return paths
+
+
+def convert_as(model, asys, dest_base, port_allocator, previous_fingerprint=None,
+               link_mode="copy"):
+    """
+    Convert a single AS into its Kathara node directory, and the node
+    directories of its border routers if they have their own nodes.
+
+    Args:
+        model: TopologyModel the AS belongs to
+        asys: AS to convert
+        dest_base: Base directory for the Kathara lab
+        port_allocator: PortAllocator with all ports already assigned
+        previous_fingerprint: Fingerprint recorded by the last run, the AS is
+            skipped if its inputs still match it
+        link_mode: How certs/, crypto/ and keys/ are materialised (see copy_tree)
+
+    Returns:
+        (fingerprint, log) where fingerprint identifies the converted inputs
+        and log is the list of progress messages, so parallel runs can print
+        them in order
+    """
+    log = []
+    as_name = asys.as_name
+    node_name = asys.node_name
+    as_dir = asys.source_dir
+    dest_base = lab_dir(dest_base, model, asys)
+    node_dir = dest_base / node_name / "etc" / "scion"
+
+    options = {'link_mode': link_mode, 'toml_codec': get_toml_codec().name,
+               'br_mode': model.br_mode, 'shards': model.shards,
+               'shared_certs': asys.shared_certs}
+    fingerprint = as_fingerprint(model, asys, port_allocator, options)
+    if fingerprint == previous_fingerprint and all(
+            path.exists() for path in as_output_paths(model, asys, dest_base)):
+        log.append(f"Unchanged {as_name} => {node_name}, skipping")
+        return fingerprint, log
+
+    ip = asys.service_address
+
+    log.append(f"Processing {as_name} => {node_name} ({asys.address})")
+
+    # Create node directory
+    node_dir.mkdir(parents=True, exist_ok=True)
+
+    # Copy directories: certs, crypto, keys
+    _copy_scion_dirs(asys, node_dir, link_mode, log)
+
+    if model.br_mode == "container":
+        # Convert every br*.toml into the br.toml of its router's node
+        for router in asys.border_routers.values():
+            router_dir = dest_base / router.node_name / "etc" / "scion"
+            router_dir.mkdir(parents=True, exist_ok=True)
+            _copy_scion_dirs(asys, router_dir, link_mode, log)
+            br_file = as_dir / f"{router.name}.toml"
+            if br_file.exists():
+                update_br_toml(br_file, router_dir / "br.toml", router.service_address, router.name)
+                log.append(f"  Converted {br_file.name} => {router.node_name}/br.toml")
+            else:
+                log.append(f"  Warning: {br_file.name} not found in {as_name}")
+            update_topology_json(router_dir / "topology.json", model, asys, port_allocator)
+            log.append(f"  Generated {router.node_name}/topology.json")
+    elif model.br_mode == "process":
+        # Convert every br*.toml into the configuration of its own process
+        unit_dir = dest_base / node_name / "etc" / "systemd" / "system"
+        unit_dir.mkdir(parents=True, exist_ok=True)
+        for router in asys.border_routers.values():
+            br_file = as_dir / f"{router.name}.toml"
+            if br_file.exists():
+                update_br_toml(br_file, node_dir / f"{router.instance}.toml", ip, router.name,
+                               router.api_port)
+                log.append(f"  Converted {br_file.name} => {router.instance}.toml")
+            else:
+                log.append(f"  Warning: {br_file.name} not found in {as_name}")
+            write_atomic(unit_dir / f"scion-router-{router.instance}.service", router_unit(router))
+    else:
+        # Convert br*.toml to br.toml
         br_files = list(as_dir.glob("br*.toml"))
         if br_files:
             br_file = br_files[0]
-            shutil.copy2(br_file, node_dir / "br.toml")
-            print(f"  Copied and renamed {br_file.name} => br.toml")
-            # Update br.toml configuration
-            update_br_toml(node_dir / "br.toml", node_number)
-            print(f"  Updated br.toml configuration")
-        else:
-            print(f"  Warning: No br*.toml file found in {as_name}")
-
-        # Find and rename cs*.toml to cs.toml
-        cs_files = list(as_dir.glob("cs*.toml"))
-        if cs_files:
-            cs_file = cs_files[0]
-            shutil.copy2(cs_file, node_dir / "cs.toml")
-            print(f"  Copied and renamed {cs_file.name} => cs.toml")
-            # Update cs.toml configuration
-            update_cs_toml(node_dir / "cs.toml", node_number)
-            print(f"  Updated cs.toml configuration")
-        else:
-            print(f"  Warning: No cs*.toml file found in {as_name}")
-
-        # Copy sd.toml
-        sd_file = as_dir / "sd.toml"
-        if sd_file.exists():
-            shutil.copy2(sd_file, node_dir / "sd.toml")
-            print(f"  Copied sd.toml")
-            # Update sd.toml configuration
-            update_sd_toml(node_dir / "sd.toml", node_number)
-            print(f"  Updated sd.toml configuration")
-        else:
-            print(f"  Warning: sd.toml not found in {as_name}")
-
-        # Copy topology.json
-        topology_file = as_dir / "topology.json"
-        if topology_file.exists():
-            shutil.copy2(topology_file, node_dir / "topology.json")
-            print(f"  Copied topology.json")
-            # Update topology.json configuration
-            update_topology_json(node_dir / "topology.json", node_number, port_allocator)
-            print(f"  Updated topology.json configuration")
+            update_br_toml(br_file, node_dir / "br.toml", ip)
+            log.append(f"  Converted {br_file.name} => br.toml")
         else:
-            print(f"  Warning: topology.json not found in {as_name}")
+            log.append(f"  Warning: No br*.toml file found in {as_name}")
+
+    # Convert cs*.toml to cs.toml
+    cs_files = list(as_dir.glob("cs*.toml"))
+    if cs_files:
+        cs_file = cs_files[0]
+        update_cs_toml(cs_file, node_dir / "cs.toml", ip)
+        log.append(f"  Converted {cs_file.name} => cs.toml")
+    else:
+        log.append(f"  Warning: No cs*.toml file found in {as_name}")
+
+    # Convert sd.toml
+    sd_file = as_dir / "sd.toml"
+    if sd_file.exists():
+        update_sd_toml(sd_file, node_dir / "sd.toml", ip)
+        log.append(f"  Converted sd.toml")
+    else:
+        log.append(f"  Warning: sd.toml not found in {as_name}")
+
+    # Render topology.json from the model
+    update_topology_json(node_dir / "topology.json", model, asys, port_allocator)
+    log.append(f"  Generated topology.json")
+
+    return fingerprint, log
+
+
+def write_shared_certs(dest_base, model, link_mode="copy"):
+    """
+    Write the certs/ directories (TRCs) of the ASes that share them once
+    per lab, content-addressed under shared/certs/<digest>/, which the
+    nodes' /etc/scion/certs link to.
+
+    Args:
+        dest_base: Base directory for the Kathara lab
+        model: TopologyModel of the converted topology
+        link_mode: How the directories are materialised (see copy_tree)
+
+    Returns:
+        Number of directories written
+    """
+    written = 0
+    for asys in model.ases.values():
+        if asys.shared_certs is None:
+            continue
+        certs_dir = lab_dir(dest_base, model, asys) / "shared" / "certs" / asys.shared_certs
+        if certs_dir.exists():
+            # Content-addressed, so an existing directory is up to date
+            continue
+        certs_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = certs_dir.with_name(f".{certs_dir.name}.tmp")
+        copy_tree(asys.source_dir / "certs", tmp_dir, link_mode)
+        tmp_dir.rename(certs_dir)
+        written += 1
+    return written
+
+
+# Arguments shared by all conversions of a worker process, set once per
+# process instead of being pickled for every AS
+_worker_args = None
+
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+
+def _convert_as_in_worker(isd_as, previous_fingerprint):
+    model, dest_base, port_allocator, link_mode = _worker_args
+    return convert_as(model, model.ases[isd_as], dest_base, port_allocator,
+                      previous_fingerprint, link_mode)
+
+
+def _log_as_results(ases, results, log):
+    """
+    Print the progress messages of the converted ASes in order, warnings
+    even when quiet, and return their fingerprints by AS name.
+    """
+    fingerprints = {}
+    for asys, (fingerprint, as_log) in zip(ases, results):
+        fingerprints[asys.as_name] = fingerprint
+        for line in as_log:
+            if 'Warning' in line:
+                print(line)
+            else:
+                log(line)
+    return fingerprints
+
+
+def validate_topology(model, base_port=DEFAULT_BASE_PORT, max_port=65535, excluded_ports=()):
+    """
+    Check a topology for problems that would break the conversion or the lab.
+
+    Args:
+        model: TopologyModel to check
+        base_port: First port that would be assigned to links
+        max_port: Last port that would be assigned to links
+        excluded_ports: (first, last) port ranges that would not be assigned
+
+    Returns:
+        List of problem descriptions, empty if the topology is fine
+    """
+    problems = []
+
+    for asys in model.ases.values():
+        for pattern in ("br*.toml", "cs*.toml", "sd.toml"):
+            if not any(asys.source_dir.glob(pattern)):
+                problems.append(f"{asys.as_name}: no {pattern} found")
+        for dir_name in ("certs", "crypto", "keys"):
+            if not (asys.source_dir / dir_name).is_dir():
+                problems.append(f"{asys.as_name}: {dir_name}/ not found")
+
+        for interface in asys.interfaces():
+            if interface.remote_isd_as not in model.ases:
+                problems.append(f"{asys.isd_as} interface {interface.ifid}: "
+                                f"remote AS {interface.remote_isd_as} is not in the topology")
+            elif interface.link is None:
+                problems.append(f"{asys.isd_as} interface {interface.ifid}: "
+                                f"no matching interface in {interface.remote_isd_as}")
+            if 'underlay' not in interface.data:
+                problems.append(f"{asys.isd_as} interface {interface.ifid}: no underlay")
+
+    try:
+        preallocate_ports(model, PortAllocator(base_port, max_port, excluded_ports))
+    except ValueError as e:
+        problems.append(str(e))
+
+    return problems
+
+
+def convert(source_base, dest_base, jobs=1, force=False, link_mode="copy",
+            base_port=DEFAULT_BASE_PORT, image=DEFAULT_IMAGE, quiet=False,
+            address_pool=DEFAULT_ADDRESS_POOL, isd_pools=None,
+            internal_pool=DEFAULT_INTERNAL_POOL, underlay="shared",
+            link_pool=DEFAULT_LINK_POOL, intra_as="shared", br_mode="consolidated",
+            br_cpus=None, max_port=65535, excluded_ports=(), shards=1, shard_hosts=None,
+            backend="kathara", instance=None, warm_start=False, shared_certs=False):
+    """
+    Convert a generated SCION topology into a Kathara lab.
+
+    Args:
+        source_base: Directory containing the generated AS directories
+        dest_base: Base directory for the Kathara lab
+        jobs: Number of ASes to convert in parallel
+        force: Reconvert every AS, ignoring the manifest of the previous run
+        link_mode: How certs/, crypto/ and keys/ are materialised (see copy_tree)
+        base_port: First port assigned to links
+        image: Docker image of the nodes
+        quiet: Only report warnings and errors
+        address_pool: CIDR pool of the node addresses on the inter-AS network
+        isd_pools: Dictionary mapping ISD numbers to their own CIDR pools
+        internal_pool: CIDR pool of the node addresses on the internal network
+        underlay: One of UNDERLAY_MODES
+        link_pool: CIDR pool of the /31 link networks with point-to-point links
+        intra_as: One of INTRA_AS_MODES
+        br_mode: One of BR_MODES
+        br_cpus: CPUs to pin the router processes to with br_mode "process"
+        max_port: Last port assigned to links
+        excluded_ports: (first, last) port ranges never assigned to links
+        shards: Number of labs (hosts) to split the topology into
+        shard_hosts: Underlay addresses of the shards' hosts, for the VXLAN bridging
+        backend: One of BACKENDS
+        instance: Lab instance ID scoping the names and address pools, so
+            that several instances can run on one host
+        warm_start: Restore the nodes' database snapshots on startup
+        shared_certs: Write the TRCs once per lab into shared/certs/ instead
+            of into every node
+
+    Returns:
+        Exit status, 0 on success
+    """
+    log = (lambda *args, **kwargs: None) if quiet else print
+
+    # Check if source exists
+    if not source_base.exists():
+        print(f"Error: Source directory {source_base} does not exist!")
+        return 1
+
+    # Create destination base if it doesn't exist
+    dest_base.mkdir(parents=True, exist_ok=True)
+
+    # Load the whole topology once
+    try:
+        model = TopologyModel.load(source_base)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    if not model.ases:
+        print("Error: No AS directories found in source!")
+        return 1
+
+    log(f"Found {len(model.ases)} AS directories:")
+    for as_name, asys in sorted(model.ases_by_name.items()):
+        log(f"  {as_name} => {asys.node_name}")
+    log()
+
+    for as_dir in find_as_dirs(source_base):
+        if as_dir.name not in model.ases_by_name:
+            print(f"Warning: topology.json not found in {as_dir.name}, skipping...")
+
+    if instance is not None:
+        model.set_instance(instance)
+
+    if shared_certs:
+        for asys in model.ases.values():
+            if (asys.source_dir / "certs").is_dir():
+                asys.shared_certs = certs_digest(asys.source_dir / "certs")
+
+    if br_mode == "container":
+        model.split_border_routers()
+    elif br_mode == "process":
+        model.split_router_processes(br_cpus)
+
+    # Give every node its addresses before converting, like the ports below
+    try:
+        if instance is not None:
+            address_pool = instance_network(address_pool, instance)
+            isd_pools = {isd: instance_network(pool, instance) for isd, pool in (isd_pools or {}).items()}
+            internal_pool = instance_network(internal_pool, instance)
+            link_pool = instance_network(link_pool, instance)
+        allocator = AddressAllocator(address_pool, isd_pools)
+        internal_allocator = AddressAllocator(internal_pool)
+        for pool in allocator.pools():
+            if pool.overlaps(internal_allocator.network):
+                raise ValueError(f"Address pools {pool} and {internal_allocator.network} overlap")
+        model.assign_addresses(allocator, internal_allocator)
+        if intra_as == "isolated":
+            model.assign_intra_as_networks(internal_allocator.network)
+        if underlay == "p2p":
+            link_network = ipaddress.IPv4Network(link_pool)
+            for pool in allocator.pools() + internal_allocator.pools():
+                if pool.overlaps(link_network):
+                    raise ValueError(f"Address pools {pool} and {link_network} overlap")
+            model.assign_link_networks(link_network)
+        if shards < 1:
+            raise ValueError(f"Invalid number of shards {shards}")
+        if shard_hosts and len(shard_hosts) != shards:
+            raise ValueError(f"{len(shard_hosts)} shard hosts given for {shards} shards")
+        if shards > 1:
+            cut = model.partition(shards)
+            log(f"Split into {shards} shards, {len(cut)} of {len(model.links)} links "
+                f"between shards\n")
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
 
-    print("\n✓ Reorganization complete!")
+    # Create a shared port allocator for all nodes
+    try:
+        port_allocator = PortAllocator(base_port, max_port, excluded_ports)
+
+        # Resolve all port assignments before converting, so that ASes can be
+        # converted in any order (or in parallel) with identical results
+        preallocate_ports(model, port_allocator)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    # Fingerprints of the previous run, used to skip unchanged ASes
+    previous_fingerprints = {} if force else load_manifest(dest_base)
+
+    # Process each AS
+    ases = list(model.ases.values())
+    previous = [previous_fingerprints.get(asys.as_name) for asys in ases]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(model, dest_base, port_allocator, link_mode)) as executor:
+            results = executor.map(_convert_as_in_worker, [asys.isd_as for asys in ases], previous)
+            fingerprints = _log_as_results(ases, results, log)
+    else:
+        results = (convert_as(model, asys, dest_base, port_allocator, fingerprint, link_mode)
+                   for asys, fingerprint in zip(ases, previous))
+        fingerprints = _log_as_results(ases, results, log)
+
+    if shared_certs:
+        written = write_shared_certs(dest_base, model, link_mode)
+        log(f"\nShared {len({asys.shared_certs for asys in ases} - {None})} certs/ "
+            f"directories between {len(ases)} ASes ({written} written)")
+
+    as_to_node = {asys.as_name: asys.node_name for asys in ases}
+    write_manifest(dest_base, as_to_node, fingerprints)
+
+    log("\n✓ Reorganization complete!")
 
     # Generate Kathara configuration files
-    print("\nGenerating Kathara configuration files...")
-    generate_kathara_configs(dest_base, as_to_node)
+    log("\nGenerating Kathara configuration files...")
+    generate_kathara_configs(dest_base, model, image, log, shard_hosts, backend, warm_start)
+    prune_stale_nodes(dest_base, model, log, backend)
+
+    log("\n✓ All done! Kathara lab is ready.")
+    return 0
+
 
-    print("\n✓ All done! Kathara lab is ready.")
+def validate(source_base, base_port=DEFAULT_BASE_PORT, quiet=False, max_port=65535,
+             excluded_ports=()):
+    """
+    Check a generated SCION topology without converting it.
+
+    Returns:
+        Exit status, 0 if no problems were found
+    """
+    if not source_base.exists():
+        print(f"Error: Source directory {source_base} does not exist!")
+        return 1
+
+    try:
+        model = TopologyModel.load(source_base)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    if not model.ases:
+        print("Error: No AS directories found in source!")
+        return 1
+
+    problems = validate_topology(model, base_port, max_port, excluded_ports)
+    for problem in problems:
+        print(f"Error: {problem}")
+
+    if problems:
+        return 1
+    if not quiet:
+        print(f"✓ {len(model.ases)} ASes and {len(model.links)} links are valid")
+    return 0
+
+
+SUBCOMMANDS = ("convert", "validate", "bench")
+
+
+def main(argv=None):
+    script_dir = Path(__file__).parent
+    if argv is None:
+        argv = sys.argv[1:]
+    # Without a subcommand, convert (e.g. "convert_scion_topology.py --jobs 8")
+    if not argv or argv[0] not in SUBCOMMANDS + ("-h", "--help"):
+        argv = ["convert"] + list(argv)
+
+    parser = argparse.ArgumentParser(description="Convert a SCION topology to a Kathara lab.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-s", "--source", type=Path, default=script_dir / "input_scion" / "gen",
+                        help="generated SCION topology (default: input_scion/gen)")
+    common.add_argument("--base-port", type=int, default=DEFAULT_BASE_PORT,
+                        help=f"first port assigned to links (default: {DEFAULT_BASE_PORT})")
+    common.add_argument("--max-port", type=int, default=65535,
+                        help="last port assigned to links (default: 65535)")
+    common.add_argument("--exclude-ports", metavar="PORTLIST",
+                        help="ports and port ranges never assigned to links, e.g. 50100-50199,51000")
+    common.add_argument("-q", "--quiet", action="store_true",
+                        help="only report warnings and errors")
+
+    convert_parser = subparsers.add_parser("convert", parents=[common],
+                                           help="convert the topology to a Kathara lab (default)")
+    convert_parser.add_argument("-d", "--dest", type=Path, default=script_dir / "KatharaLab",
+                                help="output directory of the lab (default: KatharaLab)")
+    convert_parser.add_argument("--image", default=DEFAULT_IMAGE,
+                                help=f"Docker image of the nodes (default: {DEFAULT_IMAGE})")
+    convert_parser.add_argument("-j", "--jobs", type=int, default=1,
+                                help="number of ASes to convert in parallel (default: 1)")
+    convert_parser.add_argument("-f", "--force", action="store_true",
+                                help=f"reconvert every AS, ignoring {MANIFEST_NAME}")
+    convert_parser.add_argument("--link-mode", choices=LINK_MODES, default="copy",
+                                help="how certs/, crypto/ and keys/ are placed in the node directories; "
+                                     "link modes fall back to copying across filesystems (default: copy)")
+    convert_parser.add_argument("--address-pool", default=DEFAULT_ADDRESS_POOL,
+                                help=f"CIDR pool of the node addresses on the inter-AS network "
+                                     f"(default: {DEFAULT_ADDRESS_POOL})")
+    convert_parser.add_argument("--isd-pool", action="append", default=[], metavar="ISD=CIDR",
+                                help="separate CIDR pool for the ASes of an ISD, may be repeated")
+    convert_parser.add_argument("--internal-pool", default=DEFAULT_INTERNAL_POOL,
+                                help=f"CIDR pool of the node addresses on the internal network "
+                                     f"(default: {DEFAULT_INTERNAL_POOL})")
+    convert_parser.add_argument("--underlay", choices=UNDERLAY_MODES, default="shared",
+                                help="emulate inter-AS links on one shared collision domain, or "
+                                     "with one point-to-point collision domain per link (default: shared)")
+    convert_parser.add_argument("--intra-as", choices=INTRA_AS_MODES, default="shared",
+                                help="put the internal networks of all ASes on one shared collision "
+                                     "domain, or give every AS its own (default: shared)")
+    convert_parser.add_argument("--br-mode", choices=BR_MODES, default="consolidated",
+                                help="consolidate the border routers of an AS into one router in the "
+                                     "AS node, run every router in its own node, or as its own "
+                                     "process in the AS node (default: consolidated)")
+    convert_parser.add_argument("--br-cpus", metavar="CPULIST",
+                                help="pin the router processes of --br-mode process round-robin "
+                                     "to these CPUs, e.g. 0-3,6 (default: unpinned)")
+    convert_parser.add_argument("--backend", choices=BACKENDS, default="kathara",
+                                help="generate a Kathara lab, or a lab.sh launcher running the nodes "
+                                     "in Linux network namespaces (default: kathara)")
+    convert_parser.add_argument("--instance-id", type=int, metavar="N",
+                                help=f"scope node names, collision domains and address pools to lab "
+                                     f"instance N (0-{MAX_INSTANCES - 1}), to run several instances "
+                                     f"on one host")
+    convert_parser.add_argument("--warm-start", action="store_true",
+                                help="restore the nodes' database snapshots (shared/snapshot.py) "
+                                     "before starting their services")
+    convert_parser.add_argument("--shared-certs", action="store_true",
+                                help="write the TRCs in certs/ once into shared/certs/ and link "
+                                     "each node's /etc/scion/certs to them")
+    convert_parser.add_argument("--shards", type=int, default=1,
+                                help="split the topology into this many labs, one per host, "
+                                     "bridged over VXLAN (default: 1)")
+    convert_parser.add_argument("--shard-hosts", metavar="ADDRESSES",
+                                help="comma-separated underlay addresses of the shards' hosts, "
+                                     "used by the VXLAN bridging scripts")
+    convert_parser.add_argument("--link-pool", default=DEFAULT_LINK_POOL,
+                                help=f"CIDR pool of the /31 networks of point-to-point links "
+                                     f"(default: {DEFAULT_LINK_POOL})")
+
+    subparsers.add_parser("validate", parents=[common],
+                          help="check the topology without converting it")
+
+    bench_parser = subparsers.add_parser("bench", help="run benchmark.py")
+    bench_parser.add_argument("args", nargs=argparse.REMAINDER,
+                              help="arguments for benchmark.py")
+
+    args = parser.parse_args(argv)
+    excluded_ports = ()
+    if getattr(args, "exclude_ports", None):
+        try:
+            excluded_ports = parse_port_ranges(args.exclude_ports)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.command == "convert":
+        if args.link_mode == "symlink" and args.backend == "kathara":
+            parser.error("--link-mode symlink needs --backend netns, Kathara containers cannot "
+                         "resolve symlinks into the host filesystem")
+        isd_pools = {}
+        for isd_pool in args.isd_pool:
+            isd, _, pool = isd_pool.partition("=")
+            if not isd.isdigit() or not pool:
+                parser.error(f"invalid --isd-pool {isd_pool!r}, expected ISD=CIDR")
+            isd_pools[int(isd)] = pool
+        if args.shards < 1:
+            parser.error(f"invalid --shards {args.shards}, expected at least 1")
+        if args.instance_id is not None and not 0 <= args.instance_id < MAX_INSTANCES:
+            parser.error(f"invalid --instance-id {args.instance_id}")
+        br_cpus = None
+        if args.br_cpus is not None:
+            try:
+                br_cpus = parse_cpu_list(args.br_cpus)
+            except ValueError as e:
+                parser.error(str(e))
+        return convert(args.source, args.dest, jobs=max(1, args.jobs), force=args.force,
+                       link_mode=args.link_mode, base_port=args.base_port, image=args.image,
+                       quiet=args.quiet, address_pool=args.address_pool, isd_pools=isd_pools,
+                       internal_pool=args.internal_pool, underlay=args.underlay,
+                       link_pool=args.link_pool, intra_as=args.intra_as,
+                       br_mode=args.br_mode, br_cpus=br_cpus, max_port=args.max_port,
+                       excluded_ports=excluded_ports, shards=args.shards,
+                       shard_hosts=args.shard_hosts.split(",") if args.shard_hosts else None,
+                       backend=args.backend, instance=args.instance_id,
+                       warm_start=args.warm_start, shared_certs=args.shared_certs)
+    if args.command == "validate":
+        return validate(args.source, base_port=args.base_port, quiet=args.quiet,
+                        max_port=args.max_port, excluded_ports=excluded_ports)
+
+    import benchmark
+    benchmark.main(args.args)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
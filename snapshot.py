@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Warm-start snapshots of the SCION databases of a node, for labs
+generated by convert_scion_topology.py --warm-start.
+
+save: copies a node's trust.db, beacon.db and path.db into a per-node
+store, consistently even while the services are running (SQLite online
+backup). Run it in every node once the lab has converged, e.g.
+    kathara exec as1_110 -- python3 /shared/snapshot.py save as1_110
+
+restore: copies the snapshot back before the services start, unless it
+is stale: taken with other certificates, keys or topology, older than
+the lifetime of the beacons, or past the expiry of the AS certificates.
+The .startup scripts run it on every boot.
+
+The converter copies this script into the lab's shared/ directory.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import re
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+DATABASES = ("trust.db", "beacon.db", "path.db")
+META_NAME = "snapshot.json"
+
+# Beacons and the segments built from them expire after at most 6 hours
+# (the default maximum hop field expiry), so older snapshots are stale
+DEFAULT_MAX_AGE = 6 * 3600
+
+PEM_CERTIFICATE = re.compile(rb"-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----", re.S)
+
+
+def _der_children(data, start, end):
+    """
+    Iterate over the (tag, content start, content end) of the DER
+    elements between start and end.
+    """
+    offset = start
+    while offset < end:
+        tag, length = data[offset], data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            size = length & 0x7f
+            length = int.from_bytes(data[offset:offset + size], "big")
+            offset += size
+        yield tag, offset, offset + length
+        offset += length
+
+
+def certificate_not_after(der):
+    """
+    The end of the validity period of a DER-encoded X.509 certificate, in
+    seconds since the epoch.
+    """
+    _, start, end = next(_der_children(der, 0, len(der)))
+    _, start, end = next(_der_children(der, start, end))
+    fields = [field for field in _der_children(der, start, end) if field[0] != 0xa0]
+    # serialNumber, signature, issuer, validity
+    _, start, end = fields[3]
+    (_, _, _), (tag, start, end) = list(_der_children(der, start, end))
+    text = der[start:end].decode("ascii")
+    # UTCTime (YYMMDDHHMMSSZ) or GeneralizedTime (YYYYMMDDHHMMSSZ)
+    time_format = "%y%m%d%H%M%SZ" if tag == 0x17 else "%Y%m%d%H%M%SZ"
+    return datetime.strptime(text, time_format).replace(tzinfo=timezone.utc).timestamp()
+
+
+def certificates_expiry(config_dir):
+    """
+    The earliest expiry of the AS certificate chains in crypto/as/, in
+    seconds since the epoch, or None if there are none.
+    """
+    expiries = []
+    for pem_file in sorted((config_dir / "crypto" / "as").glob("*.pem")):
+        for match in PEM_CERTIFICATE.finditer(pem_file.read_bytes()):
+            expiries.append(certificate_not_after(base64.b64decode(b"".join(match.group(1).split()))))
+    return min(expiries, default=None)
+
+
+def config_fingerprint(config_dir):
+    """
+    Hash of the node's certificates, keys and topology, which a snapshot
+    is only valid with.
+    """
+    digest = hashlib.sha256()
+    files = [config_dir / "topology.json"]
+    for name in ("certs", "crypto", "keys"):
+        files += sorted(path for path in (config_dir / name).rglob("*") if path.is_file())
+    for path in files:
+        if path.exists():
+            digest.update(f"{path.relative_to(config_dir)}\0".encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def save(node, config_dir, store):
+    """
+    Snapshot the databases of a node into store/<node>/.
+    """
+    snapshot_dir = store / node
+    tmp_dir = store / f".{node}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    saved = []
+    for name in DATABASES:
+        if not (config_dir / name).exists():
+            continue
+        source = sqlite3.connect(f"file:{config_dir / name}?mode=ro", uri=True)
+        target = sqlite3.connect(tmp_dir / name)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        saved.append(name)
+    meta = {"node": node, "created": time.time(), "expires": certificates_expiry(config_dir),
+            "fingerprint": config_fingerprint(config_dir), "databases": saved}
+    (tmp_dir / META_NAME).write_text(json.dumps(meta, indent=2) + "\n")
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    tmp_dir.rename(snapshot_dir)
+    print(f"Saved {', '.join(saved) or 'no databases'} of {node} to {snapshot_dir}")
+    return 0
+
+
+def stale_reason(meta, config_dir, max_age, now):
+    """
+    Why a snapshot cannot be restored, or None if it can.
+    """
+    if meta.get("fingerprint") != config_fingerprint(config_dir):
+        return "certificates, keys or topology changed"
+    if now - meta.get("created", 0) > max_age:
+        return f"older than {max_age}s"
+    if meta.get("expires") is not None and now >= meta["expires"]:
+        return "AS certificates expired"
+    return None
+
+
+def restore(node, config_dir, store, max_age):
+    """
+    Restore the databases of a node from store/<node>/ if the snapshot is
+    not stale. Never fails, so that a node without a usable snapshot just
+    starts cold.
+    """
+    snapshot_dir = store / node
+    try:
+        meta = json.loads((snapshot_dir / META_NAME).read_text())
+    except (OSError, ValueError):
+        print(f"No snapshot of {node}, starting cold")
+        return 0
+    reason = stale_reason(meta, config_dir, max_age, time.time())
+    if reason is not None:
+        print(f"Snapshot of {node} is stale ({reason}), starting cold")
+        return 0
+    for name in meta.get("databases", []):
+        for suffix in ("-wal", "-shm", "-journal"):
+            (config_dir / f"{name}{suffix}").unlink(missing_ok=True)
+        shutil.copyfile(snapshot_dir / name, config_dir / name)
+    print(f"Restored {', '.join(meta.get('databases', []))} of {node} from {snapshot_dir}")
+    return 0
+
+
+def main(argv=None):
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Save or restore warm-start snapshots of a node.")
+    parser.add_argument("action", choices=("save", "restore"))
+    parser.add_argument("node", help="name of the node")
+    parser.add_argument("--config-dir", type=Path, default=Path("/etc/scion"),
+                        help="SCION configuration directory of the node (default: /etc/scion)")
+    parser.add_argument("--store", type=Path, default=script_dir / "snapshots",
+                        help="directory of the snapshots (default: snapshots/ next to this script)")
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE,
+                        help=f"seconds after which a snapshot is stale (default: {DEFAULT_MAX_AGE})")
+    args = parser.parse_args(argv)
+
+    if args.action == "save":
+        return save(args.node, args.config_dir, args.store)
+    return restore(args.node, args.config_dir, args.store, args.max_age)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
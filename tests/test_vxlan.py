@@ -0,0 +1,23 @@
+import sys
+import unittest
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+from convert_scion_topology import TopologyModel, vxlan_script  # noqa: E402
+
+
+class VxlanScriptTest(unittest.TestCase):
+    def test_attaches_to_kathara_bridge(self):
+        model = TopologyModel.load(REPO / "input_scion" / "gen")
+        model.partition(2)
+        script = vxlan_script(model, 0, ["192.0.2.1", "192.0.2.2"])
+        # Kathara's Docker network plugin names bridges kt-<network ID[:12]>
+        self.assertIn('master "kt-$(echo "$network" | cut -c1-12)" up', script)
+        self.assertNotIn('"br-', script)
+        self.assertIn("attach net_0 ", script)
+
+
+if __name__ == "__main__":
+    unittest.main()